@@ -0,0 +1,149 @@
+#!/usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the Jamf side of Reinstall_oneclick_mac.py against the local mock Jamf server (mock_jamf.py)
+
+For each inventory size, a child process runs what the app does before the config screen (serial number,
+credentials check, computer lookup, installers search) then the history upload to a local SFTP stand-in.
+It reports the durations, the requests and bytes sent by the mock and the peak memory of the child.
+
+Usage : bench_jamf.py [--sizes 1000,10000,50000] [--latency 0.005] [--error-rate 0] [--record-kb 4]
+                      [--history-records 1000] [--scan] [--json results.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, '..'))
+sys.path.insert(0, bench_dir)
+from mock_jamf import MockJamf
+
+
+def peak_memory_mb():
+    '''Peak resident memory of this process, ru_maxrss is in KB on Linux and in bytes on macOS'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def client(url, serial, work_dir, results):
+    '''Child process : run the app functions against the mock and send the measures back'''
+    import logging
+    import requests
+    import Reinstall_oneclick_mac as app
+    app.log.setLevel(logging.WARNING)
+    app.requests = requests
+    app.jamf = {
+        'url_jamf':url,
+        'policy_match_name':'Install macOS',
+        'sftp_address':'local:22',
+        'sftp_credentials':'user:password',
+        'macos_last_version':'10.14.6',
+        'autologon':'non',
+        'api_user':'user',
+        'api_pswd':'password',
+    }
+    app.sftp_root = '/'
+    app.cache_file = os.path.join(work_dir, 'cache.json')
+    app.spool_dir = os.path.join(work_dir, 'spool')
+    app.settings['serial_file'] = os.path.join(work_dir, 'serial')
+    app.settings['installers_dir'] = work_dir
+    app.serial_providers = [provider for provider in app.serial_providers if provider[0] == 'file']
+    with open(app.settings['serial_file'], 'w') as f:
+        f.write(serial)
+    remote_dir = os.path.join(work_dir, 'sftp')
+    os.makedirs(remote_dir)
+    app.sftp_connect = lambda: app.LocalSFTPStandIn(remote_dir)
+
+    headers = {'Accept':'application/json'}
+    auth = {'api_user':'user', 'api_pass':'password'}
+    measures = {}
+    try:
+        start = time.time()
+        my_serial = app.get_serial()
+        app.check_credentials(headers, auth)
+        measures['connect'] = time.time() - start
+        lookup_start = time.time()
+        comp = app.find_computer(my_serial, headers, auth)
+        measures['lookup'] = time.time() - lookup_start
+        if comp is None:
+            raise Exception("Mac {} introuvable".format(my_serial))
+        policies_start = time.time()
+        install_type, installers = app.find_installers(headers, auth)
+        measures['policies'] = time.time() - policies_start
+        measures['config_screen'] = time.time() - start
+
+        upload_start = time.time()
+        if app.upload_history(headers, auth, comp['id'], my_serial, comp['name']) is False:
+            raise Exception("Echec de l'upload de l'historique")
+        measures['upload_history'] = time.time() - upload_start
+    except Exception as e:
+        measures['error'] = '{}'.format(e)
+    measures['peak_mb'] = peak_memory_mb()
+    results.put(measures)
+
+
+def run_scenario(size, options):
+    mock = MockJamf(
+        computers=size,
+        record_kb=options.record_kb,
+        latency=options.latency,
+        error_rate=options.error_rate,
+        history_records=options.history_records,
+        serial_lookup=not options.scan
+    )
+    url = mock.start()
+    work_dir = tempfile.mkdtemp(prefix='bench_jamf_')
+    try:
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(target=client, args=(url, MockJamf.serial(size / 2 + 1), work_dir, results))
+        child.start()
+        measures = results.get()
+        child.join()
+    finally:
+        mock.stop()
+        shutil.rmtree(work_dir, True)
+    measures['size'] = size
+    measures['mode'] = 'scan' if options.scan else 'direct'
+    measures['requests'] = mock.request_count()
+    measures['sent_kb'] = mock.bytes_sent / 1024.0
+    measures['requests_detail'] = mock.requests
+    return measures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Jamf de Reinstall_oneclick_mac.py sur un serveur Jamf simulé')
+    parser.add_argument('--sizes', default='1000,10000,50000', help="Tailles d'inventaire, séparées par des virgules")
+    parser.add_argument('--latency', type=float, default=0.005, help='Latence ajoutée à chaque requête (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Proportion de réponses 500')
+    parser.add_argument('--record-kb', type=float, default=4, help="Taille d'une fiche ordinateur complète (Ko)")
+    parser.add_argument('--history-records', type=int, default=1000, help="Nombre d'entrées par section d'historique")
+    parser.add_argument('--scan', action='store_true', help='Désactive la recherche par numéro de série pour forcer le scan')
+    parser.add_argument('--json', help='Enregistre les résultats dans ce fichier JSON')
+    options = parser.parse_args()
+
+    os.environ['JAMF_FTV_LOG'] = os.path.join(tempfile.gettempdir(), 'bench_jamf_ftv.log')
+
+    rows = []
+    for size in [int(size) for size in options.sizes.split(',')]:
+        rows.append(run_scenario(size, options))
+
+    print('{:>8} {:>7} {:>12} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'.format('Macs', 'mode', 'écran (s)', 'lookup', 'policies', 'upload', 'requêtes', 'Ko reçus', 'pic Mo'))
+    for row in rows:
+        if 'error' in row:
+            print('{:>8} {:>7}  erreur : {}'.format(row['size'], row['mode'], row['error']))
+            continue
+        print('{:>8} {:>7} {:>12.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9} {:>9.1f} {:>8.1f}'.format(
+            row['size'], row['mode'], row['config_screen'], row['lookup'], row['policies'], row['upload_history'], row['requests'], row['sent_kb'], row['peak_mb']))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,51 @@
+#!/usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Microbenchmark of the serial number providers of Reinstall_oneclick_mac.py
+
+Usage : bench_serial.py [runs]
+Each provider is called <runs> times (5 by default), then get_serial is timed with a cold and a warm cache.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Reinstall_oneclick_mac as app
+
+
+def timed(func, runs):
+    '''Call func runs times, return the result and the min / mean durations in ms'''
+    durations = []
+    result = None
+    for i in range(runs):
+        start = time.time()
+        try:
+            result = func()
+        except Exception as e:
+            result = 'erreur : {}'.format(e)
+        durations.append((time.time() - start) * 1000)
+    return result, min(durations), sum(durations) / len(durations)
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rows = []
+    for name, provider in app.serial_providers:
+        rows.append([name] + list(timed(provider, runs)))
+
+    # Cold cache : the cached serial is removed before each call
+    def cold():
+        with app.cache_lock:
+            cache = app.load_cache()
+            cache.pop('serial', None)
+            app.save_cache(cache)
+        return app.get_serial()
+    rows.append(['get_serial (cache vide)'] + list(timed(cold, runs)))
+    rows.append(['get_serial (cache)'] + list(timed(app.get_serial, runs)))
+
+    print('{:<26} {:>10} {:>10}  {}'.format('provider', 'min (ms)', 'moy (ms)', 'résultat'))
+    for name, result, best, mean in rows:
+        print('{:<26} {:>10.2f} {:>10.2f}  {}'.format(name, best, mean, result))
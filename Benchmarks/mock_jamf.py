@@ -0,0 +1,265 @@
+#!/usr/local/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the Jamf Classic API endpoints used by Reinstall_oneclick_mac.py :
+computers (list, id, serialnumber, match), buildings, policies (list, id, name), computerhistory (JSON and XML),
+computer deletion and the Jamf Pro API bearer token. Inventory size, record size, latency and error rate are configurable.
+Responses are gzip compressed when the client accepts it.
+
+Usage : mock_jamf.py [computers] [port]
+"""
+
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib
+
+
+class MockJamfServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockJamfHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ''' Answers the /JSSResource requests from the inventory of the MockJamf owning the server '''
+    protocol_version = 'HTTP/1.1'
+    # Buffered writes and no Nagle, otherwise every header line is a packet waiting for a delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if len(body) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buffer = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as f:
+                f.write(body)
+            body = buffer.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+        self.server.mock.count_bytes(len(body))
+
+    def send_json(self, code, obj):
+        self.send_body(code, json.dumps(obj))
+
+    def handle_request(self, method):
+        mock = self.server.mock
+        mock.count(method, self.path)
+        if mock.latency > 0:
+            time.sleep(mock.latency)
+        if mock.error_rate > 0 and random.random() < mock.error_rate:
+            return self.send_body(500, '<html><body>Internal Server Error</body></html>', 'text/html')
+        for route_method, pattern, func in mock.routes:
+            match = re.match(pattern + '$', self.path)
+            if route_method == method and match:
+                return func(self, *[urllib.unquote(group) if group else group for group in match.groups()])
+        self.send_body(404, '<html><body>Not Found</body></html>', 'text/html')
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+class MockJamf():
+    ''' Mock Jamf server running on a thread. Computer N has the serial number 'MOCK000000N'. '''
+    def __init__(self, computers=1000, record_kb=4, latency=0.0, error_rate=0.0, policies=200,
+                 history_records=1000, serial_lookup=True, seed=0):
+        self.computers = computers
+        self.record_kb = record_kb
+        self.latency = latency
+        self.error_rate = error_rate
+        self.policies = policies
+        self.history_records = history_records
+        self.serial_lookup = serial_lookup
+        self.deleted = set()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+        random.seed(seed)
+        self.routes = [
+            ['GET', r'/JSSResource/computers', MockJamf.computers_list],
+            ['GET', r'/JSSResource/computers/id/(\d+)(?:/subset/([\w&]+))?', MockJamf.computer_by_id],
+            ['GET', r'/JSSResource/computers/serialnumber/([^/]+)(?:/subset/([\w&]+))?', MockJamf.computer_by_serial],
+            ['GET', r'/JSSResource/computers/match/([^/]+)', MockJamf.computers_match],
+            ['DELETE', r'/JSSResource/computers/id/(\d+)', MockJamf.computer_delete],
+            ['GET', r'/JSSResource/buildings', MockJamf.buildings],
+            ['GET', r'/JSSResource/policies', MockJamf.policies_list],
+            ['GET', r'/JSSResource/policies/id/(\d+)(?:/subset/([\w&]+))?', MockJamf.policy_by_id],
+            ['GET', r'/JSSResource/policies/name/(.+?)(?:/subset/([\w&]+))?', MockJamf.policy_by_name],
+            ['GET', r'/JSSResource/computerhistory/id/(\d+)', MockJamf.computer_history],
+            ['POST', r'/api/v1/auth/(?:token|keep-alive)', MockJamf.auth_token],
+        ]
+        self.server = None
+
+    # Server
+    def start(self, port=0):
+        self.server = MockJamfServer(('127.0.0.1', port), MockJamfHandler)
+        self.server.mock = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def count(self, method, path):
+        endpoint = method + ' ' + re.sub(r'/(\d+|MOCK\d+)(?=/|$)', '/{}', path.split('?')[0])
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def request_count(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def count_bytes(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+    # Inventory
+    @staticmethod
+    def serial(comp_id):
+        return 'MOCK{:07d}'.format(comp_id)
+
+    def exists(self, comp_id):
+        return 1 <= comp_id <= self.computers and comp_id not in self.deleted
+
+    def general(self, comp_id):
+        return {
+            'id':comp_id,
+            'name':'Mac-{}'.format(comp_id),
+            'serial_number':self.serial(comp_id),
+            'udid':'UDID-{}'.format(comp_id),
+            'platform':'Mac'
+        }
+
+    def record(self, comp_id, subset=None):
+        record = {'general':self.general(comp_id)}
+        if subset is None:
+            # Padding to the configured record size, like the applications and extension attributes of a real record
+            apps = int(self.record_kb * 1024 / 100)
+            record['software'] = {'applications':[{'name':'Application {}'.format(i), 'path':'/Applications/App{}.app'.format(i), 'version':'1.0.{}'.format(i)} for i in range(apps)]}
+            record['extension_attributes'] = []
+        return record
+
+    # Routes
+    @staticmethod
+    def computers_list(handler):
+        mock = handler.server.mock
+        handler.send_json(200, {'computers':[{'id':i, 'name':'Mac-{}'.format(i)} for i in range(1, mock.computers + 1) if i not in mock.deleted]})
+
+    @staticmethod
+    def computer_by_id(handler, comp_id, subset=None):
+        mock = handler.server.mock
+        if not mock.exists(int(comp_id)):
+            return handler.send_body(404, '<html><body>Not Found</body></html>', 'text/html')
+        handler.send_json(200, {'computer':mock.record(int(comp_id), subset)})
+
+    @staticmethod
+    def computer_by_serial(handler, serial, subset=None):
+        mock = handler.server.mock
+        comp_id = int(serial[4:]) if re.match(r'MOCK\d+$', serial) else 0
+        if not mock.serial_lookup or not mock.exists(comp_id):
+            return handler.send_body(404, '<html><body>Not Found</body></html>', 'text/html')
+        handler.send_json(200, {'computer':mock.record(comp_id, subset)})
+
+    @staticmethod
+    def computers_match(handler, pattern):
+        mock = handler.server.mock
+        comp_id = int(pattern[4:]) if re.match(r'MOCK\d+$', pattern) else 0
+        found = []
+        if mock.serial_lookup and mock.exists(comp_id):
+            found.append(mock.general(comp_id))
+        handler.send_json(200, {'computers':found})
+
+    @staticmethod
+    def computer_delete(handler, comp_id):
+        mock = handler.server.mock
+        if not mock.exists(int(comp_id)):
+            return handler.send_body(404, '<html><body>Not Found</body></html>', 'text/html')
+        with mock.lock:
+            mock.deleted.add(int(comp_id))
+        handler.send_body(200, '<?xml version="1.0" encoding="UTF-8"?><computer><id>{}</id></computer>'.format(comp_id), 'application/xml')
+
+    @staticmethod
+    def auth_token(handler):
+        expires = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() + 1200))
+        handler.send_json(200, {'token':'mock-token-{}'.format(int(time.time() * 1000)), 'expires':expires})
+
+    @staticmethod
+    def buildings(handler):
+        handler.send_json(200, {'buildings':[{'id':i, 'name':'Building {}'.format(i)} for i in range(1, 51)]})
+
+    @staticmethod
+    def policies_list(handler):
+        mock = handler.server.mock
+        handler.send_json(200, {'policies':[{'id':i, 'name':MockJamf.policy_name(i)} for i in range(1, mock.policies + 1)]})
+
+    @staticmethod
+    def policy_name(policy_id):
+        if policy_id % 20 == 0:
+            return 'Install macOS 10.14.{}'.format(policy_id / 20)
+        return 'Policy {}'.format(policy_id)
+
+    @staticmethod
+    def policy_by_id(handler, policy_id, subset=None):
+        policy = {'general':{'id':int(policy_id), 'name':MockJamf.policy_name(int(policy_id)), 'trigger_other':'trigger_{}'.format(policy_id)}}
+        if subset is None:
+            # Scope and scripts of a real policy
+            policy['scope'] = {'computers':[{'id':i, 'name':'Mac-{}'.format(i)} for i in range(100)]}
+            policy['scripts'] = [{'id':1, 'name':'Script', 'parameter4':'x' * 200}]
+        handler.send_json(200, {'policy':policy})
+
+    @staticmethod
+    def policy_by_name(handler, name, subset=None):
+        mock = handler.server.mock
+        for policy_id in range(1, mock.policies + 1):
+            if MockJamf.policy_name(policy_id) == name:
+                return MockJamf.policy_by_id(handler, str(policy_id), subset)
+        handler.send_body(404, '<html><body>Not Found</body></html>', 'text/html')
+
+    @staticmethod
+    def computer_history(handler, comp_id):
+        mock = handler.server.mock
+        count = mock.history_records
+        if 'xml' in handler.headers.get('Accept', ''):
+            logs = ''.join('<policy_log><policy_id>{0}</policy_id><policy_name>Policy {0}</policy_name><username>admin</username><date_completed>2019/08/21 at 10:00 AM</date_completed><status>Completed</status></policy_log>'.format(i) for i in range(count))
+            usage = ''.join('<usage_log><event>login</event><username>user{0}</username><date_time>2019/08/21 at 10:00 AM</date_time></usage_log>'.format(i) for i in range(count))
+            body = '<?xml version="1.0" encoding="UTF-8"?><computer_history><general><id>{}</id></general><computer_usage_logs>{}</computer_usage_logs><policy_logs>{}</policy_logs></computer_history>'.format(comp_id, usage, logs)
+            return handler.send_body(200, body, 'application/xml')
+        handler.send_json(200, {'computer_history':{
+            'general':{'id':int(comp_id), 'serial_number':MockJamf.serial(int(comp_id))},
+            'computer_usage_logs':[{'event':'login', 'username':'user{}'.format(i), 'date_time':'2019/08/21 at 10:00 AM'} for i in range(count)],
+            'policy_logs':[{'policy_id':i, 'policy_name':'Policy {}'.format(i), 'username':'admin', 'date_completed':'2019/08/21 at 10:00 AM', 'status':'Completed'} for i in range(count)],
+        }})
+
+
+if __name__ == '__main__':
+    mock = MockJamf(computers=int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    print('Mock Jamf démarré sur {}'.format(mock.start(int(sys.argv[2]) if len(sys.argv) > 2 else 8080)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
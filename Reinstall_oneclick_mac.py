@@ -27,239 +27,1682 @@ v0.7.3 : Removed pop up after launch reset command
 v0.7.4 : Added autologon option
 v0.7.5 : Added caffeine module to prevent mac from sleeping
 v0.7.6 : Added jamfHelper splash screen before reboot
+v0.8.1 : Computer lookup by serial number before falling back to the full inventory scan
+v0.8.2 : Jamf API calls go through a shared keep-alive session with timeouts and retries
+v0.8.3 : Concurrent inventory scan with progress on the waiting screen
+v0.8.4 : Local cache of the serial number -> Jamf ID index, validated by ID and expired on a TTL
+v0.8.5 : Jamf API calls and commands moved to worker threads, UI updated through an events queue
+v0.8.6 : Reset steps run as a dependency graph, independent steps in parallel
+v0.8.7 : Jamf history streamed to a gzip file, optional CSV export of its logs sections
+v0.8.8 : SFTP uploads on a single connection, resumed and verified, spooled locally when the server is down
+v0.8.9 : Serial number read from ioreg and cached for the current boot, system_profiler as last resort
+v0.9.1 : Every compatible local macOS installer is detected and offered, versions compared properly
+v0.9.2 : Policies catalog cached by ID, details of the selected policy prefetched on the config screen
+v0.9.3 : Headless mode with JSON progress lines, without Tkinter nor AppKit
+v0.9.4 : Admin bulk decommission mode : concurrent history archive and Jamf deletion of a list of serials
+v0.9.5 : Timing spans of the API calls, jamf commands, SFTP transfers and steps, JSON metrics saved with the history
+v0.9.6 : Jamf commands output streamed to the log, download progress displayed, inactivity and total timeouts
+v0.9.7 : Optional prefetch of the selected remote installer while the config screen is displayed
+v0.9.8 : Jamf Pro API bearer token shared by all the API calls and renewed before expiry, login checked with the token request
+v0.9.9 : Window displayed first, requests, pysftp, caffeine, AppKit and the serial number loaded in background, --profile-startup mode
+v1.0.1 : Logs written by a single thread, startosinstall output captured through it, log pane tailing the log file in the window
+v1.0.2 : Journal of the completed reset steps, an interrupted reset is resumed where it stopped
+v1.0.3 : Installer payload hashed in parallel blocks and checked against a reference digest before the reset, digests cached
+v1.0.4 : Registry of the pre-wipe uninstall policies, their targets probed concurrently and shown before confirmation, policies run only when needed
+v1.0.5 : Jamf commands run one at a time by a single executor, identical pending commands coalesced
+v1.0.6 : Only the General subset of the computers and policies requested, gzip responses, ujson when installed, only the used fields kept
 """
 
 title = 'JAMF OneClick Reinstall'
-version = 'Version 0.7.6 - 21/08/2019'
+version = 'Version 1.0.6 - 18/10/2026'
 
 
 ###########################################################################
 #### Import internal libraries
 ###########################################################################
-import Tkinter as tk
-import tkMessageBox
-import ttk
-import tkFont as tkfont 
+import time
+startup_time = time.time()
 import logging
 import sys
 import os
 import subprocess
 import re
 import threading
-import time
 import csv
 import json
+import contextlib
+import signal
+import Queue
+import gzip
+import hashlib
+import posixpath
+import shutil
+import plistlib
+import urllib
+import calendar
+import atexit
+import glob
+from xml.etree import cElementTree as ElementTree
 from logging.handlers import RotatingFileHandler
 
 
 ###########################################################################
 ### Activatin main logger in a rotated log file
 ###########################################################################
+class QueueLogHandler(logging.Handler):
+    ''' Hand the log records to a single writer thread, the UI and the workers never wait for the disk.
+    The records are written by the target handlers in the order they were logged. '''
+    def __init__(self, *targets):
+        logging.Handler.__init__(self)
+        self.targets = targets
+        self.records = Queue.Queue()
+        thread = threading.Thread(target=self.writer, name='log_writer')
+        thread.daemon = True
+        thread.start()
+
+    def emit(self, record):
+        try:
+            # Formatted now, the arguments and the exception may be gone when the writer gets the record
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.records.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def writer(self):
+        while True:
+            record = self.records.get()
+            for target in self.targets:
+                if record.levelno >= target.level:
+                    target.handle(record)
+            self.records.task_done()
+
+    def flush(self, timeout=5):
+        '''Wait until the queued records are written'''
+        deadline = time.time() + timeout
+        while self.records.unfinished_tasks > 0 and time.time() < deadline:
+            time.sleep(0.01)
+
 try:
-    logs_file = '/var/log/jamf_ftv.log'
-    handler = RotatingFileHandler(logs_file, maxBytes=10000000, backupCount=5)
-    handler.setFormatter(logging.Formatter('%(asctime)s : %(message)s'))
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s : %(message)s')
+    logs_file = os.environ.get('JAMF_FTV_LOG', '/var/log/jamf_ftv.log')
+    log_format = logging.Formatter('%(asctime)s : %(message)s')
     log = logging.getLogger(__name__)
-    log.addHandler(handler)
+    # The file gets the records of this script only, the console those of the libraries too
+    file_handler = RotatingFileHandler(logs_file, maxBytes=10000000, backupCount=5)
+    file_handler.setFormatter(log_format)
+    file_handler.addFilter(logging.Filter(log.name))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(log_format)
+    log_handler = QueueLogHandler(file_handler, console_handler)
+    logging.getLogger().addHandler(log_handler)
+    logging.getLogger().setLevel(logging.INFO)
+    atexit.register(log_handler.flush)
     log.info("Initialisation du fichier de log dans {}".format(logs_file))
+    cache_file = os.path.join(os.path.dirname(logs_file), 'jamf_ftv_cache.json')
+    spool_dir = os.path.join(os.path.dirname(logs_file), 'jamf_ftv_spool')
+    metrics_file = os.path.join(os.path.dirname(logs_file), 'jamf_ftv_metrics.json')
+    journal_file = os.path.join(os.path.dirname(logs_file), 'jamf_ftv_journal.json')
 except Exception as e:
     sys.exit("*** Erreur *** Impossible d'initialiser le fichier de logs : {}".format(e))
 
 
 ###########################################################################
-### Tools API Jamf
+### Default tuning settings (Jamf script parameters stop at $11)
 ###########################################################################
-def get_serial():
-    """Getting computer's serial number"""
+settings = {
+    'api_timeout':30,         # Seconds before giving up on a Jamf API request
+    'api_retries':3,          # Retries on connection errors and 5xx responses
+    'api_backoff':0.5,        # Exponential backoff factor between retries
+    'api_pool_size':10,       # Maximum keep-alive connections to the Jamf server
+    'api_max_rate':0,         # Maximum Jamf API requests per second for all threads, 0 for no cap
+    'scan_workers':8,         # Concurrent computer_detail calls during an inventory scan
+    'scan_max_workers':16,    # Hard cap on scan workers to avoid overloading the Jamf server
+    'scan_max_missing':50,    # Records deleted during an inventory scan skipped before it is aborted
+    'cache_ttl':86400,        # Seconds before a cached serial number -> Jamf ID entry expires
+    'history_csv':False,      # Also export the logs sections of the Jamf history as CSV files
+    'sftp_chunk_size':262144, # Size of the blocks written to the SFTP server
+    'serial_file':'/sys/class/dmi/id/product_serial',  # Serial number file of the 'file' provider
+    'installers_dir':'/Applications',                  # Where the 'Install macOS *.app' installers are searched
+    'policies_ttl':300,       # Seconds before the policies catalog is fetched again
+    'bulk_workers':8,         # Computers decommissioned simultaneously in the admin bulk mode
+    'bulk_max_rate':20,       # Jamf API requests per second cap of the admin bulk mode
+    'jamf_inactivity_timeout':1800,  # Seconds without any output before a jamf command is killed, 0 to disable
+    'jamf_total_timeout':14400,      # Maximum duration of a jamf command in seconds, 0 to disable
+    'prefetch_installer':False,      # Start downloading the selected remote installer before the reset is confirmed
+    'prefetch_on_cancel':'stop',     # Prefetched download when the user gives up : 'stop' it or 'keep' it running
+    'api_token':True,         # Authenticate with a Jamf Pro API bearer token instead of sending the credentials each time
+    'token_refresh_margin':60,  # Seconds before its expiry when the bearer token is renewed
+    'journal_ttl':604800,     # Seconds during which an interrupted reset can be resumed from its journal
+    'installer_digest':os.environ.get('JAMF_FTV_INSTALLER_DIGEST', ''),  # Reference payload digest (--installer-digest), empty to skip the comparison
+    'verify_workers':4,       # Threads hashing the installer payload
+    'verify_chunk_size':8388608,    # Size of the reads while hashing
+}
+
+
+###########################################################################
+### Run metrics
+###########################################################################
+class Metrics():
+    ''' Timing spans of the run : Jamf API calls, jamf commands, SFTP transfers and reset steps '''
+    def __init__(self, started=None):
+        self.lock = threading.Lock()
+        self.started = started or time.time()
+        self.spans = []
+
+    def record(self, kind, name, start, duration, **fields):
+        span = {'kind':kind, 'name':name, 'start':round(start - self.started, 3), 'duration':round(duration, 3)}
+        span.update(fields)
+        span.setdefault('status', 'ok')
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **fields):
+        '''Time the enclosed block. The yielded dict can be completed with fields like 'bytes' or 'status'.'''
+        start = time.time()
+        span = dict(fields)
+        try:
+            yield span
+        except Exception:
+            span['status'] = 'error'
+            raise
+        finally:
+            self.record(kind, name, start, time.time() - start, **span)
+
+    def summary(self):
+        '''Count, errors, total and max duration and bytes of the spans, by kind and name'''
+        summary = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = summary.setdefault(span['kind'], {}).setdefault(span['name'], {'count':0, 'errors':0, 'total':0, 'max':0, 'bytes':0})
+            entry['count'] += 1
+            entry['errors'] += 0 if span['status'] == 'ok' else 1
+            entry['total'] = round(entry['total'] + span['duration'], 3)
+            entry['max'] = max(entry['max'], span['duration'])
+            entry['bytes'] += span.get('bytes', 0)
+        return summary
+
+    def write(self, file_path):
+        '''Write the JSON metrics of the run'''
+        try:
+            with self.lock:
+                spans = list(self.spans)
+            with open(file_path, 'w') as f:
+                json.dump({
+                    'version':version,
+                    'started':time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                    'duration':round(time.time() - self.started, 3),
+                    'summary':self.summary(),
+                    'spans':spans
+                }, f, indent=1)
+            return file_path
+        except Exception as e:
+            log.warning("Impossible d'écrire les métriques dans {} : {}".format(file_path, e))
+            return None
+
+metrics = Metrics(startup_time)
+
+def endpoint_name(path):
+    '''Jamf endpoint of a request path, without the IDs, serial numbers and names'''
+    path = re.sub(r'/(id|serialnumber|match|name)/[^/]+', r'/\1/{}', path)
+    return re.sub(r'/\d+(?=/|$)', '/{}', path)
+
+def startup_report():
+    '''Lines of the imports and init durations, for the --profile-startup mode'''
+    with metrics.lock:
+        spans = [span for span in metrics.spans if span['kind'] in ['import', 'init', 'preload']]
+    lines = []
+    for span in sorted(spans, key=lambda span: span['start']):
+        lines.append('{:<8} {:<12} début {:7.3f}s  durée {:7.3f}s{}'.format(
+            span['kind'], span['name'], span['start'], span['duration'], '' if span['status'] == 'ok' else '  (erreur)'))
+    return lines
+
+
+###########################################################################
+### Background loading of the heavy libraries
+###########################################################################
+class Preload():
+    ''' Slow startup task (heavy import, serial number lookup) run on a thread once the window is displayed.
+    get() starts it if needed, waits for its end and returns its result or raises its error.
+    Python 2 imports hold a global lock, so nothing should be imported by the UI thread while it runs. '''
+    def __init__(self, name, task, *args):
+        self.name = name
+        self.task = task
+        self.args = args
+        self.lock = threading.Lock()
+        self.thread = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='preload_' + self.name)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        try:
+            with metrics.span('preload', self.name):
+                self.result = self.task(*self.args)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def get(self):
+        self.start()
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+preloads = {}
+
+def preload(name, task, *args):
+    '''Register a startup task, run by start_preloads() or by its first preloaded() call'''
+    preloads[name] = Preload(name, task, *args)
+    return preloads[name]
+
+def start_preloads():
+    for task in preloads.values():
+        task.start()
+
+def wait_preloads():
+    for task in preloads.values():
+        task.start()
+        task.done.wait()
+
+def preloaded(name):
+    '''Wait for a startup task and return its result, None if it was not registered'''
+    if name not in preloads:
+        return None
+    return preloads[name].get()
+
+def import_module(name):
+    '''Import a library as a global of this script, timed in the run metrics'''
+    with metrics.span('import', name):
+        module = __import__(name)
+    globals()[name] = module
+    return module
+
+def enable_caffeine():
+    '''Prevent the Mac from sleeping during the reinstall'''
     try:
-        cmd = "system_profiler SPHardwareDataType | grep 'Serial Number' | awk '{print $4}'"
-        result = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        sn = [line for line in result.stdout]
-        my_serial = re.sub(r'\W+', '', sn[0])
-        log.info('Votre numéro de série est : {}'.format(my_serial))
-        return my_serial
-    except:
+        import_module('caffeine').on(display=True)
+        log.info("Module Caffeine activé, mise en veille interdite")
+    except Exception:
+        log.warning("Impossible d'activer le module caffeine, le Mac risque de passer en mode veille en cours d'installation")
+
+
+###########################################################################
+### Jamf API client
+###########################################################################
+class JamfClient():
+    ''' Keep-alive HTTP client for the Jamf Classic API, shared by all the API tools '''
+    def __init__(self, url, auth, headers=None):
+        self.url = url.rstrip('/')
+        self.timeout = settings['api_timeout']
+        self.session = requests.Session()
+        self.token = JamfToken(self, auth)
+        self.session.auth = self.token
+        self.session.headers.update(headers or {'Accept':'application/json'})
+        self.session.headers['Accept-Encoding'] = 'gzip'
+
+        # Retry with backoff on connection errors and server errors, keep the last response otherwise
+        retry = requests.packages.urllib3.util.retry.Retry(
+            total=settings['api_retries'],
+            backoff_factor=settings['api_backoff'],
+            status_forcelist=[500, 502, 503, 504],
+            raise_on_status=False
+        )
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings['api_pool_size'],
+            max_retries=retry
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, path, **kwargs):
+        '''Send a request on the pooled session with the default timeout'''
+        kwargs.setdefault('timeout', self.timeout)
+        api_rate_limiter.wait()
+        with metrics.span('api', '{} {}'.format(method, endpoint_name(path))) as span:
+            response = self.session.request(method, self.url + path, **kwargs)
+            if response.status_code == 401 and 'auth' not in kwargs and self.token.token is not None:
+                # Token revoked on the server side, a new one is requested once
+                self.token.invalidate()
+                response = self.session.request(method, self.url + path, **kwargs)
+            span['status_code'] = response.status_code
+            if response.status_code >= 400:
+                span['status'] = 'error'
+            if kwargs.get('stream') is True:
+                span['bytes'] = int(response.headers.get('Content-Length') or 0)
+            else:
+                span['bytes'] = len(response.content)
+                # Compressed size, as received
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    span['wire_bytes'] = response.raw.tell()
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+class JamfToken():
+    ''' Bearer token of the Jamf Pro API, used as the requests authentication of a JamfClient.
+    It is obtained once with the credentials, then renewed shortly before it expires.
+    Servers without the token API, or settings['api_token'] disabled, keep the basic authentication. '''
+    def __init__(self, client, auth):
+        self.client = client
+        self.basic = (auth['api_user'], auth['api_pass'])
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires = 0
+        self.supported = settings['api_token']
+
+    def __call__(self, request):
+        token = self.get()
+        if token is None:
+            return requests.auth.HTTPBasicAuth(*self.basic)(request)
+        request.headers['Authorization'] = 'Bearer {}'.format(token)
+        return request
+
+    def get(self):
+        '''Return a valid token, None when the basic authentication is used'''
+        with self.lock:
+            if self.supported is False:
+                return None
+            now = time.time()
+            if self.token is not None and now < self.expires - settings['token_refresh_margin']:
+                return self.token
+            if self.token is not None and now < self.expires:
+                try:
+                    self.store(self.client.post('/api/v1/auth/keep-alive', auth=self.bearer(self.token)))
+                    return self.token
+                except Exception as e:
+                    log.warning("Renouvellement du jeton Jamf impossible, nouvelle authentification : {}".format(e))
+            self.store(self.client.post('/api/v1/auth/token', auth=self.basic))
+            return self.token
+
+    def store(self, response):
+        if response.status_code == 404 and self.token is None:
+            log.info("API Jamf Pro sans jeton d'authentification, authentification basique conservée")
+            self.supported = False
+            return
+        if response.status_code == 401:
+            self.token = None
+            raise ValueError("Identifiants refusés par le serveur Jamf")
+        response.raise_for_status()
+        data = decode_json(response)
+        self.token = data['token']
+        self.expires = self.parse_expires(data.get('expires'))
+        log.info("Jeton d'authentification Jamf obtenu, valable jusqu'à {}".format(time.strftime('%H:%M:%S', time.localtime(self.expires))))
+
+    def invalidate(self):
+        with self.lock:
+            self.token = None
+
+    @staticmethod
+    def bearer(token):
+        def authenticate(request):
+            request.headers['Authorization'] = 'Bearer {}'.format(token)
+            return request
+        return authenticate
+
+    @staticmethod
+    def parse_expires(expires):
+        '''Expiry as an ISO 8601 UTC date (Jamf Pro 10.35+) or epoch milliseconds (older /uapi), 20 minutes if missing'''
+        try:
+            if isinstance(expires, (int, long, float)):
+                return expires / 1000.0
+            return calendar.timegm(time.strptime(expires[:19], '%Y-%m-%dT%H:%M:%S'))
+        except Exception:
+            return time.time() + 1200
+
+class RateLimiter():
+    ''' Cap shared by all threads on the number of Jamf API requests per second (settings['api_max_rate'], 0 for no cap) '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if settings['api_max_rate'] <= 0:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + 1.0 / settings['api_max_rate']
+        if delay > 0:
+            time.sleep(delay)
+
+api_rate_limiter = RateLimiter()
+
+jamf_clients = {}
+jamf_clients_lock = threading.Lock()
+
+try:
+    # About twice as fast as json on large responses, used when installed
+    import ujson
+    json_loads = ujson.loads
+except ImportError:
+    json_loads = json.loads
+
+def decode_json(response):
+    '''Body of a Jamf JSON response'''
+    return json_loads(response.content)
+
+def computer_summary(general):
+    '''The only fields of a computer record this app uses'''
+    return {
+        'id':general['id'],
+        'name':general['name'],
+        'serial_number':general['serial_number']
+    }
+
+def jamf_client(auth):
+    '''Return the shared Jamf API client for these credentials, creating it on first use'''
+    preloaded('requests')
+    key = (jamf['url_jamf'], auth['api_user'], auth['api_pass'])
+    with jamf_clients_lock:
+        if key not in jamf_clients:
+            jamf_clients[key] = JamfClient(jamf['url_jamf'], auth)
+        return jamf_clients[key]
+
+
+###########################################################################
+### Local cache of the serial number -> Jamf computer index
+###########################################################################
+cache_lock = threading.Lock()
+
+def load_cache():
+    '''Read the local cache file, an unreadable or missing file gives an empty cache'''
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        cache.setdefault('computers', {})
+        return cache
+    except (IOError, ValueError):
+        return {'computers':{}}
+
+def save_cache(cache):
+    '''Write the local cache file atomically'''
+    try:
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_file, cache_file)
+    except Exception as e:
+        log.warning("Impossible d'écrire le cache local {} : {}".format(cache_file, e))
+
+def cache_computers(computers):
+    '''Store serial number -> id/name entries in the local cache'''
+    now = time.time()
+    with cache_lock:
+        cache = load_cache()
+        for comp in computers:
+            cache['computers'][comp['serial_number']] = {
+                'id':comp['id'],
+                'name':comp['name'],
+                'serial_number':comp['serial_number'],
+                'cached_at':now
+            }
+        save_cache(cache)
+
+def uncache_computer(comp_id):
+    '''Remove every cache entry pointing to the given Jamf ID'''
+    with cache_lock:
+        cache = load_cache()
+        for serial, entry in cache['computers'].items():
+            if entry['id'] == comp_id:
+                del cache['computers'][serial]
+        save_cache(cache)
+
+def lookup_in_cache(serial, headers, auth, progress=None):
+    '''Strategy 0 : cached Jamf ID, validated with a single record fetch'''
+    with cache_lock:
+        entry = load_cache()['computers'].get(serial)
+    if entry is None:
         return None
+    if time.time() - entry['cached_at'] > settings['cache_ttl']:
+        log.info("Entrée du cache local expirée pour {}".format(serial))
+        return None
+    comp = computer_detail(entry['id'], headers, auth)
+    if comp is None:
+        log.info("Entrée du cache local obsolète pour {}, l'ID {} a été supprimé de Jamf".format(serial, entry['id']))
+        uncache_computer(entry['id'])
+        return None
+    if comp['serial_number'] != serial:
+        log.info("Entrée du cache local obsolète pour {}, l'ID {} a changé de Mac".format(serial, entry['id']))
+        uncache_computer(entry['id'])
+        return None
+    return comp
+
+
+###########################################################################
+### Catalog of the Jamf policies
+###########################################################################
+class PolicyCatalog():
+    ''' Jamf policies list fetched once, with the details of each policy fetched by ID.
+    Everything is kept for settings['policies_ttl'] seconds. '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetched_at = 0
+        self.ids = {}
+        self.ordered_names = []
+        self.cached_details = {}
+
+    def refresh(self, headers, auth):
+        '''Fetch the policies list if it is missing or expired, the lock must be held'''
+        if time.time() - self.fetched_at < settings['policies_ttl']:
+            return
+        response = jamf_client(auth).get('/JSSResource/policies', headers=headers)
+        policies = decode_json(response)['policies']
+        self.ids = dict((policy['name'], policy['id']) for policy in policies)
+        self.ordered_names = [policy['name'] for policy in policies]
+        self.cached_details = {}
+        self.fetched_at = time.time()
+        log.info("Catalogue des policies Jamf chargé : {} policies".format(len(policies)))
+
+    def names(self, headers, auth):
+        with self.lock:
+            self.refresh(headers, auth)
+            return list(self.ordered_names)
+
+    def details(self, headers, auth, name):
+        '''General section of a policy ('id', 'name' and 'trigger_other'), fetched by ID when the policy is in the catalog'''
+        with self.lock:
+            self.refresh(headers, auth)
+            if name not in self.cached_details:
+                if name in self.ids:
+                    path = '/JSSResource/policies/id/{}/subset/General'.format(self.ids[name])
+                else:
+                    path = '/JSSResource/policies/name/{}/subset/General'.format(urllib.quote(name.encode('utf-8'), safe=''))
+                general = decode_json(jamf_client(auth).get(path, headers=headers))['policy']['general']
+                self.cached_details[name] = {
+                    'id':general['id'],
+                    'name':general['name'],
+                    'trigger_other':general['trigger_other']
+                }
+            return self.cached_details[name]
 
+    def prefetch(self, headers, auth, name):
+        '''Fetch the details of a policy in background, errors are only logged'''
+        def fetch():
+            try:
+                self.details(headers, auth, name)
+                log.info("Détails de la policy '{}' préchargés".format(name.encode('utf-8')))
+            except Exception as e:
+                log.warning("Préchargement de la policy '{}' impossible : {}".format(name.encode('utf-8'), e))
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+
+policy_catalog = PolicyCatalog()
+
+
+###########################################################################
+### Serial number providers
+###########################################################################
+def clean_serial(value):
+    return re.sub(r'\W+', '', value)
+
+def serial_from_ioreg():
+    '''Read the serial number from the IOKit platform device, without the full hardware profile'''
+    out = subprocess.Popen(['/usr/sbin/ioreg', '-c', 'IOPlatformExpertDevice', '-d', '2'], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+    match = re.search(r'"IOPlatformSerialNumber" = "([^"]+)"', out)
+    if match is None:
+        return None
+    return clean_serial(match.group(1))
+
+def serial_from_file():
+    '''Read the serial number from a file, the DMI product serial on Linux (used for testing)'''
+    try:
+        with open(settings['serial_file'], 'r') as f:
+            return clean_serial(f.read()) or None
+    except IOError:
+        return None
+
+def serial_from_system_profiler():
+    '''Read the serial number from the full hardware profile, slow but always there on macOS'''
+    cmd = "system_profiler SPHardwareDataType | grep 'Serial Number' | awk '{print $4}'"
+    result = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    sn = [line for line in result.stdout]
+    return clean_serial(sn[0])
+
+serial_providers = [
+    ['ioreg', serial_from_ioreg],
+    ['file', serial_from_file],
+    ['system_profiler', serial_from_system_profiler]
+]
+
+def boot_id():
+    '''Identifier of the current boot, used to key the cached serial number'''
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()
+    except IOError:
+        return subprocess.Popen(['/usr/sbin/sysctl', '-n', 'kern.boottime'], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0].strip()
+
+def get_serial():
+    """Getting computer's serial number, from the cache of this boot or from the fastest provider"""
+    try:
+        boot = boot_id()
+        with cache_lock:
+            cached = load_cache().get('serial')
+        if cached is not None and cached['boot'] == boot:
+            log.info('Votre numéro de série est : {} (cache)'.format(cached['value']))
+            return cached['value']
+    except Exception as e:
+        boot = None
+        log.warning("Cache du numéro de série illisible : {}".format(e))
+
+    for name, provider in serial_providers:
+        start = time.time()
+        try:
+            my_serial = provider()
+        except Exception as e:
+            log.warning("Numéro de série non obtenu via '{}' : {}".format(name, e))
+            continue
+        if my_serial:
+            log.info('Votre numéro de série est : {} (via {} en {:.3f}s)'.format(my_serial, name, time.time() - start))
+            if boot is not None:
+                with cache_lock:
+                    cache = load_cache()
+                    cache['serial'] = {'value':my_serial, 'boot':boot}
+                    save_cache(cache)
+            return my_serial
+    return None
+
+
+###########################################################################
+### Tools API Jamf
+###########################################################################
 def list_computers(headers, auth):
     '''List all the computers in Jamf'''
-    url = jamf['url_jamf'] + '/JSSResource/computers'
-    response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
-    return response.json()['computers']
+    path = '/JSSResource/computers'
+    response = jamf_client(auth).get(path, headers=headers)
+    return decode_json(response)['computers']
+
+def check_credentials(headers, auth):
+    '''Validate the credentials with a single small request : the bearer token request,
+    or the buildings list on servers without the token API'''
+    if jamf_client(auth).token.get() is None:
+        list_buildings(headers, auth)
+    return True
 
 def list_buildings(headers, auth):
     '''List all the available buildings in Jamf'''
-    url = jamf['url_jamf'] + '/JSSResource/buildings'
-    response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
+    path = '/JSSResource/buildings'
+    response = jamf_client(auth).get(path, headers=headers)
     buildings = []
-    for building in response.json()['buildings']:
+    for building in decode_json(response)['buildings']:
         buildings.append(building["name"])
     return buildings
   
 def computer_detail(id, headers, auth):
-    '''Get all the details of this Mac.'''
-    url = jamf['url_jamf'] + '/JSSResource/computers/id/{}'.format(id)
-    response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
-    return response.json()['computer']
+    '''Get the ID, name and serial number of a computer, from the General section of its record. Returns None if unknown.'''
+    path = '/JSSResource/computers/id/{}/subset/General'.format(id)
+    response = jamf_client(auth).get(path, headers=headers)
+    if response.status_code == 404:
+        return None
+    return computer_summary(decode_json(response)['computer']['general'])
 
-def search_local_installer(recommended_version):
-    '''Search for a macOS installer and check its version in the package'''
+def computer_by_serial(serial, headers, auth):
+    '''Get the ID, name and serial number of a computer from its serial number. Returns None if unknown.'''
+    path = '/JSSResource/computers/serialnumber/{}/subset/General'.format(serial)
+    response = jamf_client(auth).get(path, headers=headers)
+    if response.status_code == 404:
+        return None
+    return computer_summary(decode_json(response)['computer']['general'])
+
+def match_computers(pattern, headers, auth):
+    '''Search the computers matching a pattern (name, serial number, MAC address...)'''
+    path = '/JSSResource/computers/match/{}'.format(pattern)
+    response = jamf_client(auth).get(path, headers=headers)
+    return [computer_summary(computer) for computer in decode_json(response)['computers'] if 'serial_number' in computer]
+
+def scan_computers(serial, headers, auth, progress=None):
+    '''Scan the whole inventory with a bounded pool of workers calling computer_detail.
+    No new request is sent once the serial number is found. progress(checked, total, rate)
+    is called from the calling thread while waiting for the workers. Records deleted since the
+    list was fetched are skipped, any other error aborts the scan.'''
+    ids = Queue.Queue()
+    for computer in list_computers(headers, auth):
+        ids.put(computer['id'])
+    total = ids.qsize()
+    results = Queue.Queue()
+    stop = threading.Event()
+    seen = []
+
+    def worker():
+        while not stop.is_set():
+            try:
+                comp_id = ids.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                comp = computer_detail(comp_id, headers, auth)
+                if comp is None:
+                    results.put(['missing', comp_id])
+                else:
+                    results.put(['checked', comp])
+            except Exception as e:
+                results.put(['error', e])
+
+    workers = max(1, min(settings['scan_workers'], settings['scan_max_workers'], total))
+    log.info("Scan de {} Macs dans Jamf avec {} requêtes simultanées".format(total, workers))
+    for i in range(workers):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    last_report = 0
+    checked = 0
+    missing = 0
+    try:
+        while checked < total:
+            try:
+                kind, value = results.get(timeout=0.2)
+            except Queue.Empty:
+                kind, value = None, None
+            if kind == 'error':
+                raise value
+            elif kind == 'missing':
+                # Deleted between the list and its fetch, many of them means the list can't be trusted
+                checked += 1
+                missing += 1
+                log.warning("Mac ID {} supprimé de Jamf pendant le scan, ignoré".format(value))
+                if missing > settings['scan_max_missing']:
+                    raise IOError("{} Macs introuvables pendant le scan de l'inventaire".format(missing))
+            elif kind == 'checked':
+                checked += 1
+                seen.append(value)
+                if value['serial_number'] == serial:
+                    return value
+            if progress is not None and time.time() - last_report >= 0.2:
+                last_report = time.time()
+                progress(checked, total, checked / max(last_report - start, 0.001))
+        return None
+    finally:
+        # Outstanding ids are dropped, workers exit after their current request
+        stop.set()
+        cache_computers(seen)
+        log.info("Scan terminé : {} Macs vérifiés sur {} ({} introuvables) en {:.2f}s".format(checked, total, missing, time.time() - start))
+
+def lookup_by_serial(serial, headers, auth, progress=None):
+    '''Strategy 1 : direct lookup on the serial number endpoint'''
+    return computer_by_serial(serial, headers, auth)
+
+def lookup_by_match(serial, headers, auth, progress=None):
+    '''Strategy 2 : search endpoint, keeping only an exact serial number match'''
+    for computer in match_computers(serial, headers, auth):
+        if computer['serial_number'] == serial:
+            return computer
+    return None
+
+def lookup_by_scan(serial, headers, auth, progress=None):
+    '''Strategy 3 : walk the whole inventory with concurrent workers'''
+    return scan_computers(serial, headers, auth, progress)
+
+def find_computer(serial, headers, auth, progress=None, scan=True):
+    '''Resolve a computer in Jamf from its serial number, fastest strategy first.
+    The full inventory scan is only used when the direct lookups fail, and never if scan is False.'''
+    strategies = [
+        ['cache', lookup_in_cache],
+        ['serialnumber', lookup_by_serial],
+        ['match', lookup_by_match]
+    ]
+    if scan is True:
+        strategies.append(['scan', lookup_by_scan])
+    for name, strategy in strategies:
+        start = time.time()
+        try:
+            comp = strategy(serial, headers, auth, progress)
+        except Exception as e:
+            # The inventory scan is the last resort, its errors are raised to the caller
+            if name == 'scan':
+                raise
+            log.warning("Recherche du Mac via la stratégie '{}' en échec après {:.2f}s : {}".format(name, time.time() - start, e))
+            continue
+        if comp is not None:
+            log.info("Mac identifié via la stratégie '{}' en {:.2f}s".format(name, time.time() - start))
+            cache_computers([comp])
+            return comp
+        log.info("Aucun résultat via la stratégie '{}' ({:.2f}s)".format(name, time.time() - start))
+    return None
+
+def read_plist(file_path):
+    '''Read an XML or binary plist file'''
     try:
-        version_last_digits = recommended_version[3:]
-        file = "/Applications/install macOS Mojave.app/Contents/version.plist"
-        with open(file, "r") as f:
-            content = f.read()
-        if version_last_digits in content:
-            log.info("Installeur local compatible détecté")
-            return "install macOS Mojave"
+        return plistlib.readPlist(file_path)
+    except Exception:
+        xml = subprocess.Popen(['/usr/bin/plutil', '-convert', 'xml1', '-o', '-', file_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+        return plistlib.readPlistFromString(xml)
+
+def parse_version(text):
+    '''Convert a version string like '10.14.6' into a comparable tuple (10, 14, 6)'''
+    return tuple(int(digits) for digits in re.findall(r'\d+', text))
+
+def installer_version(app_path):
+    '''macOS version installed by an installer app, from its install info or from its bundle version'''
+    install_info = os.path.join(app_path, 'Contents', 'SharedSupport', 'InstallInfo.plist')
+    if os.path.exists(install_info):
+        version = read_plist(install_info).get('System Image Info', {}).get('version')
+        if version:
+            return version
+    for plist in ['Info.plist', 'version.plist']:
+        plist_path = os.path.join(app_path, 'Contents', plist)
+        if os.path.exists(plist_path):
+            bundle_version = parse_version(read_plist(plist_path)['CFBundleShortVersionString'])
+            # Installer apps are numbered 12.x to 15.x for macOS 10.12 to 10.15, then 16.x for macOS 11...
+            if bundle_version[0] <= 15:
+                return '.'.join(str(digits) for digits in (10,) + bundle_version[:2])
+            return '.'.join(str(digits) for digits in (bundle_version[0] - 5,) + bundle_version[1:2])
+    raise IOError("Aucune information de version dans {}".format(app_path))
+
+installers_cache = {}
+
+def search_local_installers(recommended_version):
+    '''List the macOS installers compatible with the recommended version, most recent first.
+    The versions are cached against the modification time of each bundle.'''
+    found = []
+    try:
+        apps = [app for app in os.listdir(settings['installers_dir']) if re.match(r'^install macos .+\.app$', app, re.I)]
+    except OSError:
+        apps = []
+    for app in apps:
+        app_path = os.path.join(settings['installers_dir'], app)
+        try:
+            mtime = os.path.getmtime(app_path)
+            if installers_cache.get(app_path, [None])[0] != mtime:
+                installers_cache[app_path] = [mtime, installer_version(app_path)]
+            version = installers_cache[app_path][1]
+        except Exception as e:
+            log.warning("Installeur local {} illisible : {}".format(app, e))
+            continue
+        if parse_version(version) >= parse_version(recommended_version):
+            found.append([parse_version(version), app[:-len('.app')]])
         else:
-            log.info("Installeur local détecté mais version non compatible avec les recommandations Jamf : {}".format(recommended_version))
-            return False
-    except IOError:
-        log.warning("Aucun installeur macOS local trouvé dans /Applications")
-        return False
+            log.info("Installeur local {} ({}) non compatible avec les recommandations Jamf : {}".format(app, version, recommended_version))
+    if len(found) == 0:
+        log.warning("Aucun installeur macOS local compatible trouvé dans {}".format(settings['installers_dir']))
+        return []
+    found.sort(reverse=True)
+    log.info("Installeurs locaux compatibles détectés : {}".format(', '.join(name for version, name in found)))
+    return [name for version, name in found]
+
+def search_local_installer(recommended_version):
+    '''Search for the most recent compatible macOS installer, False if none is found'''
+    try:
+        installers = search_local_installers(recommended_version)
+        return installers[0] if len(installers) > 0 else False
     except Exception as e:
         log.error("Erreur inconnue dans search_local_installers : {}".format(e))
         return False
 
+def payload_files(app_path):
+    '''Files of an installer payload : the disk images and plists of Contents/SharedSupport'''
+    files = []
+    for dir_path, dir_names, file_names in os.walk(os.path.join(app_path, 'Contents', 'SharedSupport')):
+        files += [os.path.join(dir_path, file_name) for file_name in file_names]
+    return sorted(files)
+
+# Payload files are hashed by blocks of 256 Mo in parallel. Part of the digest format, the reference digests depend on it.
+payload_block_size = 268435456
+
+def hash_block(file_path, offset, size):
+    '''sha256 of size bytes of a file from offset, read by chunks'''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            chunk = f.read(min(settings['verify_chunk_size'], size))
+            if not chunk:
+                raise IOError("{} tronqué pendant la lecture".format(file_path))
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.digest()
+
+def payload_digest(app_path):
+    '''Digest of an installer payload. Each file is cut in blocks hashed in parallel, the file digest is the sha256
+    of its blocks digests and the payload digest the sha256 of the files names, sizes and digests.
+    The file digests are cached against their size and modification time.'''
+    block_size = payload_block_size
+    files = {}
+    blocks = Queue.Queue()
+    with cache_lock:
+        cached = load_cache().get('digests', {})
+    for file_path in payload_files(app_path):
+        stat = os.stat(file_path)
+        entry = {'size':stat.st_size, 'mtime':stat.st_mtime, 'block_size':block_size}
+        if file_path in cached and all(cached[file_path].get(key) == value for key, value in entry.items()):
+            entry['digest'] = cached[file_path]['digest']
+        else:
+            entry['blocks'] = [None] * max(1, (stat.st_size + block_size - 1) // block_size)
+            for index in range(len(entry['blocks'])):
+                blocks.put([file_path, index])
+        files[file_path] = entry
+
+    errors = []
+    def worker():
+        while len(errors) == 0:
+            try:
+                file_path, index = blocks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                size = min(block_size, files[file_path]['size'] - index * block_size)
+                files[file_path]['blocks'][index] = hash_block(file_path, index * block_size, size)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for i in range(min(settings['verify_workers'], blocks.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+    payload = hashlib.sha256()
+    for file_path in sorted(files):
+        entry = files[file_path]
+        if 'blocks' in entry:
+            entry['digest'] = hashlib.sha256(''.join(entry.pop('blocks'))).hexdigest()
+        payload.update('{} {} {}\n'.format(os.path.relpath(file_path, app_path), entry['size'], entry['digest']))
+    with cache_lock:
+        cache = load_cache()
+        cache['digests'] = dict((file_path, entry) for file_path, entry in cache.get('digests', {}).items() if os.path.exists(file_path))
+        cache['digests'].update(files)
+        save_cache(cache)
+    return payload.hexdigest()
+
+def verify_installer(app):
+    '''Check the payload of an installer before it erases the disk, returns its digest or None without a reference.
+    Raises an exception if it is missing, empty or different from settings['installer_digest'].'''
+    app_path = os.path.join(settings['installers_dir'], u'{}.app'.format(app))
+    files = payload_files(app_path)
+    if len(files) == 0:
+        raise IOError("Aucun fichier dans {}/Contents/SharedSupport".format(app_path.encode('utf-8')))
+    for file_path in files:
+        if os.path.getsize(file_path) == 0:
+            raise IOError("Fichier vide dans l'installeur : {}".format(file_path.encode('utf-8')))
+    # Reading the whole payload is only worth it to compare it with a reference
+    reference = settings['installer_digest'].strip().lower()
+    if not reference:
+        log.info("Installeur {} présent, pas d'empreinte de référence à vérifier".format(app.encode('utf-8')))
+        return None
+    start = time.time()
+    with metrics.span('verify', 'payload_digest') as span:
+        span['bytes'] = sum(os.path.getsize(file_path) for file_path in files)
+        digest = payload_digest(app_path)
+    log.info("Empreinte de l'installeur {} : {} (en {:.1f}s)".format(app.encode('utf-8'), digest, time.time() - start))
+    if digest != reference:
+        raise ValueError("Empreinte de l'installeur {} différente de la référence {}".format(app.encode('utf-8'), reference))
+    return digest
+
+def find_installers(headers, auth):
+    '''Return the installer type ('local' or 'remote') and the list of available installers'''
+    installers = search_local_installers(jamf['macos_last_version'])
+    if len(installers) > 0:
+        return 'local', installers
+    log.info("Recherche d'installeurs distants dans la DB Jamf")
+    return 'remote', list_policies(headers, auth, jamf['policy_match_name']) or []
+
 def list_policies(headers, auth, match):
     '''List all the available policies in Jamf and keep only the relevant ones'''
     try:
-        url = jamf['url_jamf'] + '/JSSResource/policies'
-        response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
-        policies = []
         log.info('Sélection des policies Jamf dont le nom contient : "{}"'.format(match))
-        for policy in response.json()['policies']:
-            if match in policy["name"]:
-                policies.append(policy["name"])
-        return policies
+        return [name for name in policy_catalog.names(headers, auth) if match in name]
     except Exception as e:
-        log.error("Erreur inconnue dans lisst_policies : {}".format(e))
+        log.error("Erreur inconnue dans list_policies : {}".format(e))
 
 def get_policy_details(headers, auth, policy):
+    '''Get the details of a designated policy'''
+    return policy_catalog.details(headers, auth, policy)
+
+def get_policy_trigger(headers, auth, policy):
     '''Get the event trigger for a designated policy'''
-    policy = policy.split(' ')
-    policy = "%20".join(policy)
-    url = jamf['url_jamf'] + '/JSSResource/policies/name/{}'.format(policy)
-    response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
-    return response.json()
-
-def get_computer_history(headers, auth, id):
-    '''Get a full jamf history of this Mac.'''
+    return get_policy_details(headers, auth, policy)['trigger_other']
+
+def get_computer_history(headers, auth, id, file_path):
+    '''Stream the full jamf history of this Mac to a gzip compressed JSON file. Returns the size of the history.'''
     try:
-        url = jamf['url_jamf'] + '/JSSResource/computerhistory/id/{}'.format(id)
-        response = requests.get(url, headers=headers, auth=(auth['api_user'], auth['api_pass']))
-        return response.json()
+        path = '/JSSResource/computerhistory/id/{}'.format(id)
+        response = jamf_client(auth).get(path, headers=headers, stream=True)
+        response.raise_for_status()
+        size = 0
+        with gzip.open(file_path, 'wb') as json_output:
+            for chunk in response.iter_content(chunk_size=65536):
+                json_output.write(chunk)
+                size += len(chunk)
+        return size
     except Exception as e:
         log.error("Erreur pendant la récupération de l'historique Jamf ! Raison : {}".format(e))
         return None
 
-def json_to_csv(json_file, serial, name):
-    '''Export a JSON object to a file'''
+def history_to_csv(headers, auth, id, file_prefix):
+    '''Stream the XML jamf history of this Mac and write each of its logs sections (policy logs, usage logs,
+    audits, commands...) to a gzip compressed CSV file, one record at a time. Returns the list of files.'''
+    path = '/JSSResource/computerhistory/id/{}'.format(id)
+    response = jamf_client(auth).get(path, headers={'Accept':'application/xml'}, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+
+    outputs = {}
+    parents = []
+    try:
+        for event, elem in ElementTree.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            # A record is an element below a section whose children are all simple fields
+            if len(parents) < 2 or len(elem) == 0 or any(len(field) for field in elem):
+                continue
+            section = '_'.join(parent.tag for parent in parents[1:])
+            if section not in outputs:
+                file_path = '{}_{}.csv.gz'.format(file_prefix, section)
+                csv_file = gzip.open(file_path, 'wb')
+                writer = csv.DictWriter(csv_file, fieldnames=[field.tag for field in elem], extrasaction='ignore')
+                writer.writeheader()
+                outputs[section] = [file_path, csv_file, writer]
+            outputs[section][2].writerow(dict((field.tag, (field.text or '').encode('utf-8')) for field in elem))
+            # Free the record, the memory used stays flat whatever the size of the history
+            parents[-1].remove(elem)
+    finally:
+        for file_path, csv_file, writer in outputs.values():
+            csv_file.close()
+    return sorted(output[0] for output in outputs.values())
+
+def export_history(headers, auth, comp_id, serial, name):
+    '''Export the jamf history of this Mac to local compressed files. Returns the list of files.'''
     try:
         now = time.strftime('%y%m%d-%H%M%S')
-        title = "{}_history_{}_{}.json".format(now, serial, name)
-        file_path = '/tmp/{}'.format(title)
-        with open(file_path, 'w') as json_output:
-            json.dump(json_file, json_output)
-        return file_path
+        file_prefix = '/tmp/{}_history_{}_{}'.format(now, serial, name)
+        file_path = file_prefix + '.json.gz'
+        size = get_computer_history(headers, auth, comp_id, file_path)
+        if size is None:
+            return None
+        log.info("Historique Jamf enregistré dans {} ({} octets, {} compressés)".format(file_path, size, os.path.getsize(file_path)))
+        files = [file_path]
+        if settings['history_csv'] is True:
+            files += history_to_csv(headers, auth, comp_id, file_prefix)
+            log.info("Sections de l'historique Jamf exportées en CSV : {}".format(', '.join(files[1:])))
+        return files
     except Exception as e:
-        log.error('Erreur pendant la création du fichier JSON local ! Raison : {}'.format(e), exc_info=True)
+        log.error("Erreur pendant l'export local de l'historique Jamf ! Raison : {}".format(e), exc_info=True)
         return None
 
-def sftp_upload(file_to_upload):
+def sftp_connect():
+    '''Open a connection to the SFTP server defined in the Jamf parameters'''
+    preloaded('pysftp')
+    address_and_port = jamf['sftp_address'].split(':')
+    address = address_and_port[0]
+    port = address_and_port[1]
+
+    user_and_pswd = jamf['sftp_credentials'].split(':')
+    user = user_and_pswd[0]
+    pswd = user_and_pswd[1]
+
+    cnopts = pysftp.CnOpts()
+    cnopts.hostkeys = None
+    cnopts.log = True
+    srv = pysftp.Connection(
+        host=address,
+        username=user,
+        password=pswd,
+        port=int(port),
+        cnopts=cnopts
+    )
+    log.info('Connection réussie avec {}'.format(jamf['sftp_address']))
+    return srv
+
+class LocalSFTPStandIn():
+    ''' Stand-in for an SFTP connection writing to a local directory, used to test the uploads without a server '''
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def local_path(self, remote_path):
+        return os.path.join(self.root_dir, remote_path.lstrip('/'))
+
+    def stat(self, remote_path):
+        try:
+            return os.stat(self.local_path(remote_path))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror)
+
+    def open(self, remote_path, mode='r'):
+        return open(self.local_path(remote_path), mode)
+
+    def remove(self, remote_path):
+        os.remove(self.local_path(remote_path))
+
+    def close(self):
+        pass
+
+class SFTPUploader():
+    ''' Upload files on a single SFTP connection. Partial uploads are resumed and every
+    transfer is checked against the size and the SHA-256 of the local file. '''
+    def __init__(self, connect=None, remote_dir=None):
+        self.connect = connect or sftp_connect
+        self.remote_dir = remote_dir or sftp_root
+        self.conn = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def remote_digest(self, remote_path):
+        '''SHA-256 of a remote file, computed by the server when it supports it, else read back'''
+        with self.conn.open(remote_path, 'rb') as remote:
+            try:
+                return remote.check('sha256').encode('hex')
+            except (AttributeError, IOError):
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: remote.read(settings['sftp_chunk_size']), b''):
+                    digest.update(chunk)
+                return digest.hexdigest()
+
+    def upload(self, file_to_upload, retry=True):
+        '''Upload a file, resuming from the size already on the server'''
+        if self.conn is None:
+            self.conn = self.connect()
+        remote_path = posixpath.join(self.remote_dir, os.path.basename(file_to_upload))
+        size = os.path.getsize(file_to_upload)
+        try:
+            offset = self.conn.stat(remote_path).st_size
+        except IOError:
+            offset = 0
+        if offset > size:
+            offset = 0
+        if offset > 0:
+            log.info("Reprise de l'upload de {} à l'octet {}".format(file_to_upload, offset))
+
+        start = time.time()
+        digest = hashlib.sha256()
+        with open(file_to_upload, 'rb') as local:
+            # The part already on the server is only hashed
+            done = 0
+            while done < offset:
+                chunk = local.read(min(settings['sftp_chunk_size'], offset - done))
+                digest.update(chunk)
+                done += len(chunk)
+            with self.conn.open(remote_path, 'ab' if offset > 0 else 'wb') as remote:
+                if hasattr(remote, 'set_pipelined'):
+                    remote.set_pipelined(True)
+                for chunk in iter(lambda: local.read(settings['sftp_chunk_size']), b''):
+                    remote.write(chunk)
+                    digest.update(chunk)
+        duration = max(time.time() - start, 0.001)
+        metrics.record('sftp', os.path.basename(file_to_upload), start, duration, bytes=size - offset, offset=offset)
+
+        remote_size = self.conn.stat(remote_path).st_size
+        if remote_size != size or self.remote_digest(remote_path) != digest.hexdigest():
+            log.error("Fichier {} corrompu sur le serveur SFTP ({} octets sur {})".format(remote_path, remote_size, size))
+            self.conn.remove(remote_path)
+            if retry is True:
+                return self.upload(file_to_upload, retry=False)
+            raise IOError("Echec de la vérification de {} après upload".format(remote_path))
+        log.info("Fichier {} uploadé et vérifié : {} octets en {:.2f}s ({:.2f} Mo/s)".format(
+            file_to_upload, size - offset, duration, (size - offset) / duration / 1000000))
+        return True
+
+spool_lock = threading.Lock()
+
+def spool_file(file_to_upload):
+    '''Keep a copy of a file which couldn't be uploaded, it will be sent by drain_spool'''
     try:
-        address_and_port = jamf['sftp_address'].split(':')
-        address = address_and_port[0]
-        port = address_and_port[1]
-
-        user_and_pswd = jamf['sftp_credentials'].split(':')
-        user = user_and_pswd[0]
-        pswd = user_and_pswd[1]
-
-        cnopts = pysftp.CnOpts()
-        cnopts.hostkeys = None
-        cnopts.log = True
-        srv = pysftp.Connection(
-            host=address,
-            username=user,
-            password=pswd,
-            port=int(port),
-            cnopts=cnopts
-        )
-        log.info('Connection réussie avec {}'.format(jamf['sftp_address']))
+        with spool_lock:
+            if not os.path.isdir(spool_dir):
+                os.makedirs(spool_dir)
+            shutil.copy(file_to_upload, spool_dir)
+        log.warning("Fichier {} mis en attente dans {}".format(file_to_upload, spool_dir))
     except Exception as e:
-        log.error("Erreur pendant la connexion avec {} - raison : {}".format(jamf['sftp_address'], e))
-        return False
-
+        log.error("Impossible de mettre le fichier {} en attente : {}".format(file_to_upload, e))
+
+def drain_spool(uploader=None):
+    '''Upload the files waiting in the spool directory, returns the number of files still waiting'''
+    # Locked, the spool is drained at startup in background and again by the reset before the erase
+    with spool_lock:
+        if not os.path.isdir(spool_dir) or len(os.listdir(spool_dir)) == 0:
+            return 0
+        uploader = uploader or SFTPUploader()
+        try:
+            for file_name in sorted(os.listdir(spool_dir)):
+                file_to_upload = os.path.join(spool_dir, file_name)
+                uploader.upload(file_to_upload)
+                os.remove(file_to_upload)
+        except Exception as e:
+            log.warning("Fichiers en attente non envoyés vers {} : {}".format(jamf['sftp_address'], e))
+        finally:
+            uploader.close()
+        return len(os.listdir(spool_dir))
+
+def sftp_upload(files_to_upload, uploader=None):
+    '''Upload files on a single SFTP connection. If the server can't be reached the files are spooled.
+    A given uploader is left open to be reused, but reconnects after an error.'''
+    own_uploader = uploader is None
+    uploader = uploader or SFTPUploader()
+    uploaded = 0
     try:
-        with srv.cd(sftp_root):
-            srv.put(file_to_upload)
+        for file_to_upload in files_to_upload:
+            uploader.upload(file_to_upload)
+            uploaded += 1
     except Exception as e:
-        log.error("Erreur pendant l'upload du fichier {} - raison : {}".format(file_to_upload, e), exc_info=True)
+        log.error("Erreur pendant l'upload vers {} - raison : {}".format(jamf['sftp_address'], e), exc_info=True)
+        uploader.close()
+        # The files already uploaded and verified are not spooled
+        for file_to_upload in files_to_upload[uploaded:]:
+            spool_file(file_to_upload)
+        return False
     else:
         return True
+    finally:
+        if own_uploader:
+            uploader.close()
 
 def upload_history(headers, auth, comp_id, serial, name):
-    '''Function to upload a history toward a SFTP server'''
+    '''Function to upload a history toward a SFTP server, returns the names of the uploaded files or False'''
     log.info("Récupération de l'historique depuis la base de données Jamf")
-    history = get_computer_history(headers, auth, comp_id)
-    if history is not None:
-        log.info("Conversion de l'historique JSON en fichier JSON local")
-        file_to_upload = json_to_csv(history, serial, name)
-        if file_to_upload is not None:
-            log.info("Fichier {} créé, démarrage de l'upload SFTP...".format(file_to_upload))
-            if sftp_upload(file_to_upload) is True:
-                log.info("Historique Jamf uploadé avec succès vers {}".format(jamf['sftp_address']))
-                return True
-            else:
-                return False
-        else:
-            return False
-    else:
+    files_to_upload = export_history(headers, auth, comp_id, serial, name)
+    if files_to_upload is None:
         return False
+    # The metrics of the run so far are saved with the history
+    metrics_path = metrics.write(re.sub(r'\.json\.gz$', '_metrics.json', files_to_upload[0]))
+    if metrics_path is not None:
+        files_to_upload.append(metrics_path)
+    log.info("Fichiers {} créés, démarrage de l'upload SFTP...".format(', '.join(files_to_upload)))
+    if sftp_upload(files_to_upload) is not True:
+        # Retried at once from the spool, the history has to be on the server before this Mac is erased
+        log.warning("Nouvel essai de l'upload SFTP des fichiers en attente")
+        if drain_spool() > 0:
+            return False
+    log.info("Historique Jamf uploadé avec succès vers {}".format(jamf['sftp_address']))
+    return [os.path.basename(file_path) for file_path in files_to_upload]
 
 def delete_computer(computer_id, auth):
     '''Delete the given computer from Jamf'''
-    url = jamf['url_jamf'] + '/JSSResource/computers/id/{}'.format(computer_id)
-    response = requests.delete(url, auth=(auth['api_user'], auth['api_pass']))
+    path = '/JSSResource/computers/id/{}'.format(computer_id)
+    response = jamf_client(auth).delete(path)
     response = "{}".format(response)
     if response == '<Response [200]>':
+        uncache_computer(computer_id)
         return True
     else:
         log.error("Echec de la suppression de la DB Jamf ! Réponse du serveur : {}".format(response))
         return False
 
 def launch_reset(app):
-    '''Launch the reset command'''
-    app_backslash = app.split(' ')
-    app_backslash = r'\ '.join(app_backslash)
-    cmd = r'/Applications/{}.app/Contents/Resources/startosinstall --eraseinstall --newvolumename "Macintosh HD" --nointeraction --agreetolicense >> {}'.format(app_backslash, logs_file)
-    log.info('Running command : {}'.format(cmd))
-    subprocess.call(cmd, shell=True)
+    '''Launch the reset command, its output is captured to the log file'''
+    cmd_line = [
+        '{}/{}.app/Contents/Resources/startosinstall'.format(settings['installers_dir'], app),
+        '--eraseinstall', '--newvolumename', 'Macintosh HD', '--nointeraction', '--agreetolicense'
+    ]
+    log.info('Running command : {}'.format(' '.join(cmd_line)))
+    returncode = run_streaming(cmd_line, capture_output('startosinstall'))[0]
+    log.info("startosinstall terminé avec le code {}".format(returncode))
     return True
 
-def jamf_cmd(cmd):
-    '''Launch a custom Jamf command'''
-    try:
-        cmd = cmd.split(' ')
-        cmd_line = ['/usr/local/bin/jamf'] + cmd 
-        inventory = subprocess.Popen(cmd_line, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (out, err) = inventory.communicate()
-        if inventory.returncode == 0:
-            log.info("Commande JAMF '{}' exécutée. Résultat : {}".format(cmd, out))
-            return True
+def capture_output(name):
+    '''on_line callback of run_streaming sending the output of a command to the log file, through the log writer thread'''
+    output_log = log.getChild('output')
+    def on_line(stream, line):
+        output_log.info("{} [{}] : {}".format(name, stream, line))
+    return on_line
+
+class DownloadProgress():
+    ''' Parse the download progress printed by the jamf binary into percentage, throughput and remaining time '''
+    units = {'B':1, 'KB':1e3, 'MB':1e6, 'GB':1e9}
+
+    def __init__(self):
+        self.start = time.time()
+        self.last = None
+        self.percent = None
+
+    def parse(self, line):
+        '''Returns a dict with 'percent', 'speed' (MB/s) and 'eta' (s) when the line holds a progress, else None'''
+        sizes = re.search(r'([\d.]+)\s*([KMG]?B)\s+(?:of|sur|/)\s+([\d.]+)\s*([KMG]?B)', line, re.I)
+        percent = re.search(r'(\d{1,3}(?:\.\d+)?)\s*%', line)
+        if sizes is None and percent is None:
+            return None
+        now = time.time()
+        progress = {'speed':None, 'eta':None}
+        if sizes is not None:
+            done = float(sizes.group(1)) * self.units[sizes.group(2).upper()]
+            total = float(sizes.group(3)) * self.units[sizes.group(4).upper()]
+            progress['percent'] = done / total * 100 if total > 0 else 0
+            if self.last is not None and now > self.last[0]:
+                progress['speed'] = (done - self.last[1]) / (now - self.last[0]) / 1e6
+            elif now > self.start:
+                progress['speed'] = done / (now - self.start) / 1e6
+            if progress['speed']:
+                progress['eta'] = (total - done) / (progress['speed'] * 1e6)
+            self.last = [now, done]
         else:
-            raise Exception(err)
-    except Exception as e:
-        log.error("Erreur : pendant l'exécution de la commande JAMF '{}' : {}".format(cmd, e))
-        return False
+            progress['percent'] = float(percent.group(1))
+            if progress['percent'] > 0:
+                progress['eta'] = (now - self.start) * (100 - progress['percent']) / progress['percent']
+        self.percent = progress['percent']
+        return progress
+
+def format_progress(progress):
+    '''Text of a download progress for the steps labels'''
+    text = '{:.0f}%'.format(progress['percent'])
+    if progress['speed'] is not None:
+        text += ' - {:.1f} Mo/s'.format(progress['speed'])
+    if progress['eta'] is not None and progress['eta'] > 0:
+        text += ' - reste {} min'.format(int(progress['eta'] / 60) + 1)
+    return text
+
+def run_streaming(cmd_line, on_line=None, inactivity_timeout=0, total_timeout=0, cancel=None):
+    '''Run a command and hand each line of its stdout and stderr to on_line(stream, line) as soon as it is printed.
+    The whole process group is killed if nothing is printed for inactivity_timeout seconds, if the command
+    lasts more than total_timeout seconds (0 to disable) or when the cancel event is set. Returns the return code,
+    the output, the errors and the timeout which fired if any.'''
+    process = subprocess.Popen(cmd_line, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+    lines = Queue.Queue()
+
+    def reader(stream, pipe):
+        for line in iter(pipe.readline, b''):
+            lines.put([stream, line])
+        lines.put([stream, None])
+
+    for stream, pipe in [['stdout', process.stdout], ['stderr', process.stderr]]:
+        thread = threading.Thread(target=reader, args=(stream, pipe))
+        thread.daemon = True
+        thread.start()
+
+    output = {'stdout':[], 'stderr':[]}
+    start = last_activity = time.time()
+    timed_out = None
+    open_streams = 2
+    while open_streams > 0:
+        now = time.time()
+        if inactivity_timeout > 0 and now - last_activity > inactivity_timeout:
+            timed_out = 'inactivité'
+        elif total_timeout > 0 and now - start > total_timeout:
+            timed_out = 'durée totale'
+        elif cancel is not None and cancel.is_set():
+            timed_out = 'annulation'
+        if timed_out is not None:
+            kill_process_group(process)
+            break
+        try:
+            stream, line = lines.get(timeout=1)
+        except Queue.Empty:
+            continue
+        if line is None:
+            open_streams -= 1
+            continue
+        last_activity = time.time()
+        output[stream].append(line)
+        if on_line is not None:
+            on_line(stream, line.rstrip())
+    process.wait()
+    return process.returncode, ''.join(output['stdout']), ''.join(output['stderr']), timed_out
+
+def kill_process_group(process):
+    '''Stop a process started by run_streaming and all its children, killed if they still run after 10 seconds'''
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        for i in range(100):
+            if process.poll() is not None:
+                return
+            time.sleep(0.1)
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def jamf_cmd(cmd, on_progress=None, cancel=None):
+    '''Launch a custom Jamf command through the jamf executor, True if it succeeded.
+    on_progress(progress) gets the download progress parsed from the output, setting the cancel event stops the command.'''
+    return jamf_executor.run(cmd, on_progress, cancel)
+
+def run_jamf(cmd, on_progress=None, cancel=None):
+    '''Run the jamf binary, its output is logged line by line. Only called by the jamf executor.'''
+    with metrics.span('jamf_cmd', cmd) as span:
+        try:
+            cmd = cmd.split(' ')
+            cmd_line = ['/usr/local/bin/jamf'] + cmd 
+            progress = DownloadProgress()
+
+            def on_line(stream, line):
+                log.info("jamf {} : {}".format(' '.join(cmd), line))
+                if on_progress is not None:
+                    parsed = progress.parse(line)
+                    if parsed is not None:
+                        on_progress(parsed)
+
+            returncode, out, err, timed_out = run_streaming(cmd_line, on_line, settings['jamf_inactivity_timeout'], settings['jamf_total_timeout'], cancel)
+            span['returncode'] = returncode
+            if timed_out is not None:
+                span['timed_out'] = timed_out
+                raise Exception("Délai dépassé ({}), commande arrêtée".format(timed_out))
+            if returncode == 0:
+                log.info("Commande JAMF '{}' exécutée".format(cmd))
+                return True
+            else:
+                raise Exception(err)
+        except Exception as e:
+            span['status'] = 'error'
+            log.error("Erreur : pendant l'exécution de la commande JAMF '{}' : {}".format(cmd, e))
+            return False
+
+class JamfExecutor():
+    ''' Single entry point to the jamf binary : the commands run one at a time on the executor thread, in the
+    order they were asked, so that two check-ins never overlap. Identical commands waiting together are
+    coalesced into one run whose result is given to each caller. '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = []
+        self.thread = None
+
+    def run(self, cmd, on_progress=None, cancel=None):
+        '''Queue a command and wait for its result'''
+        waiter = {'on_progress':on_progress, 'cancel':cancel, 'queued':time.time()}
+        with self.lock:
+            for job in self.pending:
+                if job['cmd'] == cmd:
+                    log.info("Commande JAMF '{}' déjà en attente, regroupée".format(cmd))
+                    break
+            else:
+                job = {'cmd':cmd, 'waiters':[], 'done':threading.Event(), 'result':False}
+                self.pending.append(job)
+            job['waiters'].append(waiter)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, name='jamf_executor')
+                self.thread.daemon = True
+                self.thread.start()
+            self.wakeup.notify()
+        job['done'].wait()
+        return job['result']
+
+    def worker(self):
+        while True:
+            with self.lock:
+                while len(self.pending) == 0:
+                    self.wakeup.wait()
+                job = self.pending.pop(0)
+                # The callers which gave up while waiting are not run for
+                waiters = [waiter for waiter in job['waiters'] if waiter['cancel'] is None or not waiter['cancel'].is_set()]
+            for waiter in waiters:
+                metrics.record('jamf_wait', job['cmd'], waiter['queued'], time.time() - waiter['queued'])
+            if len(waiters) > 0:
+                job['result'] = run_jamf(job['cmd'], lambda progress: self.progress(waiters, progress), JamfCancel(waiters))
+            job['done'].set()
+
+    @staticmethod
+    def progress(waiters, progress):
+        for waiter in waiters:
+            if waiter['on_progress'] is not None:
+                waiter['on_progress'](progress)
+
+class JamfCancel():
+    ''' Cancel event of a coalesced jamf command : set once every caller set its own, never if one of them has none '''
+    def __init__(self, waiters):
+        self.events = [waiter['cancel'] for waiter in waiters]
+
+    def is_set(self):
+        return all(event is not None and event.is_set() for event in self.events)
+
+jamf_executor = JamfExecutor()
+
+class InstallerDownload():
+    ''' Download of a remote macOS installer through its Jamf policy, which can start before the reset is confirmed.
+    The download step of the reset attaches to it, whether it is still running or already done. '''
+    def __init__(self, headers, auth, policy):
+        self.headers = headers
+        self.auth = auth
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.listeners = []
+        self.progress = None
+        self.package_name = None
+        self.error = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run(self):
+        try:
+            trigger = get_policy_trigger(self.headers, self.auth, self.policy)
+            log.info("Téléchargement de l'installeur MacOS '{}' en cours...".format(self.policy.encode('utf-8')))
+            result = jamf_cmd('policy -event {}'.format(trigger), self.on_progress, self.cancelled)
+            if self.cancelled.is_set():
+                raise Exception("Téléchargement annulé")
+            if result is not True:
+                raise Exception("La commande Jamf de téléchargement du paquet a terminé en erreur")
+            log.info("Téléchargement terminé")
+            self.package_name = search_local_installer(jamf['macos_last_version'])
+            if self.package_name is False:
+                raise Exception("Le paquet téléchargé n'a pas été trouvé dans la liste des applications")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def on_progress(self, progress):
+        with self.lock:
+            self.progress = progress
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(progress)
+
+    def attach(self, on_progress):
+        '''Get the download progress from now on, starting with the last one known'''
+        with self.lock:
+            self.listeners.append(on_progress)
+            progress = self.progress
+        if progress is not None:
+            on_progress(progress)
+
+    def wait(self, on_progress=None):
+        '''Wait for the end of the download and return the name of the downloaded installer'''
+        if on_progress is not None:
+            self.attach(on_progress)
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.package_name
+
+    def failed(self):
+        return self.done.is_set() and self.error is not None
+
+    def cancel(self):
+        self.cancelled.set()
+
+installer_download = None
+installer_download_lock = threading.Lock()
+
+def start_installer_download(headers, auth, policy):
+    '''Start the download of an installer policy, or return the download of this policy already running or done.
+    A download of another policy is stopped or left running depending on settings['prefetch_on_cancel'].'''
+    global installer_download
+    with installer_download_lock:
+        if installer_download is not None:
+            if installer_download.policy == policy and not installer_download.failed():
+                return installer_download
+            stop_installer_download(installer_download)
+        installer_download = InstallerDownload(headers, auth, policy).start()
+        return installer_download
+
+def cancel_installer_download():
+    '''Called when the user gives up the reset'''
+    global installer_download
+    with installer_download_lock:
+        if installer_download is not None:
+            stop_installer_download(installer_download)
+            installer_download = None
+
+def stop_installer_download(download):
+    if download.done.is_set():
+        return
+    if settings['prefetch_on_cancel'] == 'keep':
+        log.info("Téléchargement de '{}' abandonné, il continue en arrière-plan".format(download.policy.encode('utf-8')))
+    else:
+        log.info("Arrêt du téléchargement de '{}'".format(download.policy.encode('utf-8')))
+        download.cancel()
+
+class LogTail():
+    ''' Incremental reader of the log file : each read() returns the complete lines written since the previous one.
+    Starts with the last backlog bytes and follows the file when it is rotated. '''
+    def __init__(self, file_path, backlog=65536, max_read=1048576):
+        self.file_path = file_path
+        self.max_read = max_read
+        self.inode = None
+        self.offset = 0
+        self.partial = ''
+        try:
+            stat = os.stat(file_path)
+            self.inode = stat.st_ino
+            self.offset = max(0, stat.st_size - backlog)
+        except OSError:
+            pass
+
+    def read(self):
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return []
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.partial = ''
+        if stat.st_size == self.offset:
+            return []
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(min(stat.st_size - self.offset, self.max_read))
+        self.offset += len(data)
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        return lines
 
-def show_logs(event=None):
-    '''Launch a shell command to open log Console on the specified logfile'''
-    subprocess.call("open -a Console {}".format(logs_file), shell=True)
-    
 def show_jamfhelper():
     # Splash Screen Jamf Helper variables
     jamfHelper = "/Library/Application Support/JAMF/bin/jamfHelper.app/Contents/MacOS/jamfHelper"
@@ -271,6 +1714,617 @@ def show_jamfhelper():
     subprocess.Popen('"{}" -windowType fs -heading "{}" -description "{}" -icon "{}" &'.format(jamfHelper, heading, description, icon), shell=True)
 
 
+###########################################################################
+### Pre-wipe tasks : uninstall policies run only when their targets are found
+###########################################################################
+# 'bundles' are glob patterns of app bundles, 'receipts' regexes of pkgutil package IDs,
+# 'processes' names of running processes. Any probe finding something triggers the policy.
+prewipe_tasks = [
+    {
+        'step':'check_del_adobe',
+        'title':"Désactivation de la suite Adobe CC2019",
+        'trigger':'uninstall_adobe',
+        'bundles':['/Applications/Adobe * CC 2019/Adobe * CC 2019.app', '/Applications/Adobe * CC 2019.app'],
+        'receipts':[],
+        'processes':[],
+    },
+    {
+        'step':'check_del_eset',
+        'title':"Suppression de l'antivirus ESET",
+        'trigger':'uninstall_eset',
+        'bundles':['/Applications/ESET *.app'],
+        'receipts':[r'^com\.eset\.'],
+        'processes':['esets_daemon', 'esets_proxy', 'esets_gui'],
+    },
+]
+
+def list_receipts():
+    '''Identifiers of the packages installed on this Mac'''
+    return subprocess.check_output(['/usr/sbin/pkgutil', '--pkgs']).splitlines()
+
+def list_processes():
+    '''Names of the running processes'''
+    return [line.strip() for line in subprocess.check_output(['/bin/ps', '-axco', 'comm']).splitlines()[1:]]
+
+def detect_prewipe_targets(tasks=None):
+    '''Run the detection probes of the pre-wipe tasks, the pkgutil and ps probes concurrently.
+    Returns the evidence found for each task by step name : an empty list when its targets are absent,
+    None when a probe it needs failed and nothing was found (its policy is then run anyway).'''
+    tasks = prewipe_tasks if tasks is None else tasks
+    sources = {}
+    def probe(name, func):
+        try:
+            with metrics.span('probe', name):
+                sources[name] = func()
+        except Exception as e:
+            log.warning("Sonde '{}' en échec : {}".format(name, e))
+            sources[name] = None
+
+    threads = []
+    for name, func in [['receipts', list_receipts], ['processes', list_processes]]:
+        if any(len(task[name]) > 0 for task in tasks):
+            threads.append(threading.Thread(target=probe, args=(name, func)))
+    for thread in threads:
+        thread.start()
+    probe('bundles', lambda: dict((pattern, glob.glob(pattern)) for task in tasks for pattern in task['bundles']))
+    for thread in threads:
+        thread.join()
+
+    detected = {}
+    for task in tasks:
+        evidence = []
+        missing = False
+        for name in ['bundles', 'receipts', 'processes']:
+            if len(task[name]) == 0:
+                continue
+            if sources[name] is None:
+                missing = True
+            elif name == 'bundles':
+                evidence += [path for pattern in task['bundles'] for path in sources['bundles'][pattern]]
+            elif name == 'receipts':
+                evidence += [pkg for pkg in sources['receipts'] if any(re.match(regex, pkg) for regex in task['receipts'])]
+            else:
+                evidence += [process for process in task['processes'] if process in sources['processes']]
+        detected[task['step']] = None if missing and len(evidence) == 0 else evidence
+        log.info("{} : {}".format(task['title'], describe_targets(detected[task['step']])))
+    return detected
+
+def describe_targets(evidence):
+    '''Text of the detection result of a pre-wipe task'''
+    if evidence is None:
+        return "détection impossible, la désinstallation sera lancée"
+    if len(evidence) == 0:
+        return "non installé, rien à faire"
+    return "détecté ({})".format(', '.join(os.path.basename(item) for item in evidence[:3]) + (', ...' if len(evidence) > 3 else ''))
+
+
+###########################################################################
+### Reset pipeline
+###########################################################################
+class ResetError(Exception):
+    ''' Error stopping the reset pipeline, displayed to the user in a popup '''
+    def __init__(self, title, msg):
+        Exception.__init__(self, msg)
+        self.title = title
+
+class StepScheduler():
+    ''' Run a small graph of steps, each one on its own thread as soon as its dependencies are over.
+    A step fails by raising an exception. The failure of a critical step cancels the steps depending on it. '''
+    def __init__(self):
+        self.steps = []
+        self.requires = {}
+        self.critical = {}
+        self.funcs = {}
+        self.state = {}
+        self.results = {}
+        self.errors = {}
+        self.durations = {}
+
+    def add(self, name, func, requires=(), critical=False):
+        '''Declare a step, its dependencies must be declared before it'''
+        for dep in requires:
+            if dep not in self.funcs:
+                raise ValueError("Etape '{}' inconnue, dépendance de '{}'".format(dep, name))
+        self.steps.append(name)
+        self.funcs[name] = func
+        self.requires[name] = list(requires)
+        self.critical[name] = critical
+        self.state[name] = 'pending'
+
+    def blocked(self, name):
+        '''True if a dependency of this step failed critically or was cancelled'''
+        for dep in self.requires[name]:
+            if self.state[dep] == 'cancelled' or (self.state[dep] == 'failed' and self.critical[dep]):
+                return True
+        return False
+
+    def ready(self, name):
+        return all(self.state[dep] in ['done', 'failed'] for dep in self.requires[name])
+
+    def run(self, on_status=None):
+        '''Run all the steps and wait for them. Raises the error of the first failed critical step.'''
+        finished = Queue.Queue()
+
+        def runner(name):
+            start = time.time()
+            try:
+                result = self.funcs[name]()
+            except Exception as e:
+                metrics.record('step', name, start, time.time() - start, status='error')
+                finished.put([name, 'failed', e, time.time() - start])
+            else:
+                metrics.record('step', name, start, time.time() - start)
+                finished.put([name, 'done', result, time.time() - start])
+
+        def set_state(name, state):
+            self.state[name] = state
+            if on_status is not None:
+                on_status(name, state)
+
+        running = 0
+        while True:
+            for name in self.steps:
+                if self.state[name] != 'pending':
+                    continue
+                if self.blocked(name):
+                    log.warning("Etape '{}' annulée suite à l'échec d'une étape dont elle dépend".format(name))
+                    set_state(name, 'cancelled')
+                elif self.ready(name):
+                    set_state(name, 'running')
+                    thread = threading.Thread(target=runner, args=(name,), name=name)
+                    thread.daemon = True
+                    thread.start()
+                    running += 1
+            if running == 0:
+                break
+            name, state, value, duration = finished.get()
+            running -= 1
+            self.durations[name] = duration
+            if state == 'done':
+                self.results[name] = value
+                log.info("Etape '{}' terminée en {:.2f}s".format(name, duration))
+            else:
+                self.errors[name] = value
+                log.error("Etape '{}' en échec après {:.2f}s : {}".format(name, duration, value))
+            set_state(name, state)
+
+        for name in self.steps:
+            if self.state[name] == 'failed' and self.critical[name]:
+                raise self.errors[name]
+        return self.results
+
+    def skip(self, name, result=None):
+        '''Mark a step as done by a previous run, it will not be run'''
+        self.state[name] = 'done'
+        self.results[name] = result
+        self.durations[name] = 0
+        log.info("Etape '{}' déjà effectuée, ignorée".format(name))
+
+class ResetJournal():
+    ''' Steps of a reset completed so far with their outputs, saved in journal_file after each one.
+    A reset interrupted by a crash or a reboot is resumed from it, even once the Mac is deleted from Jamf. '''
+    def __init__(self, data):
+        self.lock = threading.Lock()
+        self.data = data
+
+    @staticmethod
+    def create(computer, install_type, installer):
+        journal = ResetJournal({
+            'computer':dict(computer),
+            'install_type':install_type,
+            'installer':installer,
+            'started':time.time(),
+            'steps':{}
+        })
+        with journal.lock:
+            journal.save()
+        return journal
+
+    @staticmethod
+    def load(serial):
+        '''Journal of an interrupted reset of this Mac, None if there is none or if it expired'''
+        try:
+            with open(journal_file, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data['computer']['serial_number'] != serial or time.time() - data['started'] > settings['journal_ttl']:
+            return None
+        return ResetJournal(data)
+
+    def complete(self, step, result=True):
+        '''Record a completed step and its output'''
+        with self.lock:
+            self.data['steps'][step] = {'result':result, 'time':time.time()}
+            self.save()
+
+    def completed(self):
+        '''Outputs of the completed steps, by step name'''
+        with self.lock:
+            return dict((step, entry['result']) for step, entry in self.data['steps'].items())
+
+    def save(self):
+        # Synced before the rename, the journal has to survive a power loss
+        try:
+            tmp_file = journal_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, journal_file)
+        except Exception as e:
+            log.warning("Impossible d'écrire le journal de réinstallation {} : {}".format(journal_file, e))
+
+    def clear(self):
+        try:
+            os.remove(journal_file)
+        except OSError:
+            pass
+
+def find_with_journal(serial, headers, auth, progress=None):
+    '''Journal of an interrupted reset of this Mac (None if there is none) and its Jamf record (None if unknown).
+    The journal is read first : once the Mac is deleted the lookup is skipped, and with a journal the
+    inventory scan is replaced by a fetch of the journaled record.'''
+    journal = ResetJournal.load(serial)
+    if journal is None:
+        return None, find_computer(serial, headers, auth, progress)
+    if 'check_del_computer' in journal.completed():
+        log.info("Mac déjà supprimé de Jamf par la réinstallation interrompue, pas de recherche")
+        return journal, None
+    comp = find_computer(serial, headers, auth, progress, scan=False)
+    if comp is None:
+        comp = computer_detail(journal.data['computer']['id'], headers, auth)
+        if comp is not None and comp['serial_number'] != serial:
+            comp = None
+    return journal, comp
+
+def reset_pipeline(headers, auth, install_type, installer, computer, set_step, journal=None, detected=None):
+    '''Build the graph of the reset steps. computer holds the Jamf 'id', 'name' and 'serial_number'
+    of this Mac, and 'deleted' when it is not in Jamf anymore. set_step(step, text, color) displays
+    the state of each step. The completed steps are recorded in journal, those it already holds are skipped.
+    detected holds the result of detect_prewipe_targets, the pre-wipe tasks probe their targets themselves without it.'''
+    pipeline = StepScheduler()
+
+    def checkpoint(step, result=True):
+        if journal is not None:
+            journal.complete(step, result)
+
+    def download():
+        # If installer is 'remote', download it from Jamf. Else launch directly the reinstall
+        if install_type != 'remote':
+            # A local installer deleted since the start of an interrupted reset can't be fetched again
+            if not os.path.isdir(os.path.join(settings['installers_dir'], u'{}.app'.format(installer))):
+                log.error("Installeur local {} introuvable".format(installer.encode('utf-8')))
+                set_step('check_download', "Installeur local introuvable !", "red")
+                raise ResetError("Erreur", "L'installeur MacOS local est introuvable ! Annulation...")
+            set_step('check_download', "Vérification de l'installeur local...", "blue")
+            try:
+                verify_installer(installer)
+            except Exception as e:
+                log.error("Installeur local {} invalide : {}".format(installer.encode('utf-8'), e))
+                set_step('check_download', "Installeur local invalide !", "red")
+                raise ResetError("Erreur", "L'installeur MacOS local est incomplet ou corrompu ! Annulation...")
+            set_step('check_download', "Installeur local sélectionné et vérifié", "green")
+            checkpoint('check_download', installer)
+            return installer
+        try:
+            # Attach to the download prefetched from the config screen if any
+            log.info("Téléchargement de l'installeur MacOS en cours, veuillez patienter...")
+            set_step('check_download', "Téléchargement de l'installeur MacOS en cours...", "blue")
+            def on_progress(progress):
+                set_step('check_download', "Téléchargement de l'installeur MacOS en cours : {}".format(format_progress(progress)), "blue")
+            package_name = start_installer_download(headers, auth, installer).wait(on_progress)
+            set_step('check_download', "Vérification de l'installeur téléchargé...", "blue")
+            verify_installer(package_name)
+            set_step('check_download', "Téléchargement terminé et validé", "green")
+            checkpoint('check_download', package_name)
+            return package_name
+        except Exception as e:
+            log.error("Erreur pendant le téléchargement : {}".format(e), exc_info=True)
+            set_step('check_download', "Téléchargement en erreur !", "red")
+            raise ResetError("Erreur", "Une erreur a empêché le téléchargement de l'installeur MacOS ! Annulation...")
+
+    def prewipe(task):
+        # Run the uninstall policy of a pre-wipe task, only if its targets were detected
+        def run():
+            if detected is not None:
+                evidence = detected.get(task['step'])
+            else:
+                evidence = detect_prewipe_targets([task])[task['step']]
+            if evidence is not None and len(evidence) == 0:
+                set_step(task['step'], "{} : Non installé".format(task['title']), "green")
+                log.info("{} : cible absente, policy {} non lancée".format(task['title'], task['trigger']))
+                checkpoint(task['step'])
+            elif jamf_cmd('policy -event {}'.format(task['trigger'])) is True:
+                log.info("{} : policy {} exécutée avec succès".format(task['title'], task['trigger']))
+                set_step(task['step'], "{} : OK".format(task['title']), "green")
+                checkpoint(task['step'])
+            else:
+                set_step(task['step'], "{} : Erreur".format(task['title']), "red")
+                log.error("{} : une erreur a empêché l'exécution de la policy {} !".format(task['title'], task['trigger']))
+        return run
+
+    def upload():
+        # Upload the computer history to our SFTP server. The erase wipes the spool too, so the
+        # Mac is neither deleted nor erased while a history file is only kept locally.
+        uploaded = upload_history(headers, auth, computer['id'], computer['serial_number'], computer['name'])
+        if uploaded is not False and drain_spool() == 0:
+            set_step('check_upload_history', "Sauvegarde des infos Jamf vers SFTP : OK", "green")
+            checkpoint('check_upload_history', uploaded)
+        else:
+            set_step('check_upload_history', "Sauvegarde des infos Jamf vers SFTP  : Erreur", "red")
+            log.error("Une erreur a empêché la sauvegarde des infos Jamf vers FTP !")
+            raise ResetError("Erreur", "L'historique Jamf n'a pas pu être sauvegardé sur le serveur SFTP ! Le Mac n'a été ni supprimé de Jamf ni réinitialisé. Merci de contacter le support IP-Echanges")
+
+    def del_computer():
+        # Delete this computer from the Jamf DB to prevent conflicts
+        if computer.get('deleted') is True:
+            log.info("Mac déjà absent de la base de données Jamf")
+            set_step('check_del_computer', "Suppression de la base Jamf : Déjà supprimé", "green")
+            checkpoint('check_del_computer', computer['id'])
+        elif delete_computer(computer['id'], auth) is True:
+            log.info("Mac supprimé de la base données Jamf avec succès")
+            set_step('check_del_computer', "Suppression de la base Jamf : OK", "green")
+            checkpoint('check_del_computer', computer['id'])
+        else:
+            set_step('check_del_computer', "Suppression de la base Jamf : Erreur", "red")
+            raise ResetError("Erreur", "Une erreur a empêché la suppression du Mac de la DB Jamf ! Merci de contacter le support IP-Echanges")
+
+    def reset():
+        # Launch the reinstall command, once the installer is checked again (free if unchanged, the digests are cached)
+        try:
+            verify_installer(pipeline.results['check_download'])
+            reset_command = threading.Thread(target=launch_reset, args=(pipeline.results['check_download'],))
+            reset_command.start()
+            set_step('check_launch_reset', "Lancement de la réinstallation : OK", "green")
+            set_step('check_reboot', "Redémarrage en cours, veuillez patientier...", "blue")
+            log.info("La procédure de réinstallation est lancée, cliquez sur OK pour autoriser le redémarrage.")
+            show_jamfhelper()
+        except Exception as e:
+            log.error("Erreur pendant la réinstallation : {}".format(e))
+            set_step('check_launch_reset', "Lancement de la réinstallation : Erreur", "red")
+            text = "Attention !\nLa commande de réinitialisation ne s'est pas effectuée correctement ! Merci de contacter le support IP-Echanges"
+            raise ResetError("Erreur pendant la réinitialisation", text)
+
+    # The download, the uninstall policies and the history backup are independent.
+    # The Jamf record is only deleted once the installer is there and the jamf policies are over,
+    # they need the record to run.
+    pipeline.add('check_download', download, critical=True)
+    prewipe_steps = [task['step'] for task in prewipe_tasks]
+    for task in prewipe_tasks:
+        pipeline.add(task['step'], prewipe(task))
+    pipeline.add('check_upload_history', upload, critical=True)
+    pipeline.add('check_del_computer', del_computer, critical=True, requires=
+        ['check_download'] + prewipe_steps + ['check_upload_history']
+    )
+    pipeline.add('check_launch_reset', reset, critical=True, requires=
+        ['check_download'] + prewipe_steps + ['check_upload_history', 'check_del_computer']
+    )
+
+    # Resuming an interrupted reset : the steps in the journal are skipped, and so are the steps they
+    # depended on, which were over. The reset itself is always launched again.
+    if journal is not None:
+        completed = journal.completed()
+        skipped = set()
+        def skip_with_requires(name):
+            if name not in skipped:
+                skipped.add(name)
+                for dep in pipeline.requires[name]:
+                    skip_with_requires(dep)
+        for name in completed:
+            if name in pipeline.funcs and name != 'check_launch_reset':
+                skip_with_requires(name)
+        package_name = completed.get('check_download')
+        if 'check_download' in skipped and (package_name is None or not os.path.isdir(os.path.join(settings['installers_dir'], u'{}.app'.format(package_name)))):
+            if install_type == 'remote':
+                log.warning("Installeur '{}' du journal introuvable, il sera téléchargé à nouveau".format(package_name))
+            else:
+                log.warning("Installeur local '{}' du journal introuvable".format(package_name))
+            skipped.discard('check_download')
+        for name in pipeline.steps:
+            if name in skipped:
+                pipeline.skip(name, completed.get(name))
+                set_step(name, "{} : Déjà effectué".format(step_titles[name]), "green")
+    return pipeline
+
+step_titles = {
+    'check_download':"Téléchargement de l'installeur MacOS",
+    'check_upload_history':"Sauvegarde des infos Jamf vers SFTP",
+    'check_del_computer':"Suppression de la base Jamf",
+    'check_launch_reset':"Réinitialisation de l'ordinateur"
+}
+step_titles.update((task['step'], task['title']) for task in prewipe_tasks)
+
+
+###########################################################################
+### Headless mode, without Tkinter
+###########################################################################
+def emit(event, **fields):
+    '''Write a machine-readable JSON progress line on stdout'''
+    fields['event'] = event
+    fields['time'] = round(time.time(), 3)
+    sys.stdout.write(json.dumps(fields) + '\n')
+    sys.stdout.flush()
+
+def timed_step(name, func, *args):
+    '''Run a lookup step of the headless mode and emit its duration'''
+    emit('step', step=name, status='running')
+    start = time.time()
+    try:
+        result = func(*args)
+    except Exception as e:
+        emit('step', step=name, status='failed', duration=round(time.time() - start, 3), error='{}'.format(e))
+        raise
+    emit('step', step=name, status='done', duration=round(time.time() - start, 3))
+    return result
+
+def run_headless():
+    '''Run the whole reset without any window, for unattended runs from a Jamf policy. Returns the exit code.'''
+    headers = {'Accept':'application/json'}
+    auth = {
+        'api_user':jamf['api_user'],
+        'api_pass':jamf['api_pswd']
+    }
+    emit('start', title=title, version=version)
+    start = time.time()
+    try:
+        serial = timed_step('serial', get_serial)
+        if serial is None:
+            raise Exception("Impossible de déterminer le numéro de série de ce Mac")
+        timed_step('connect', check_credentials, headers, auth)
+        timed_step('spool', drain_spool)
+        journal, comp = timed_step('lookup', find_with_journal, serial, headers, auth)
+        if journal is not None:
+            # Interrupted reset, resumed with its installer even if the Mac is not in Jamf anymore
+            install_type, installer = journal.data['install_type'], journal.data['installer']
+            computer = dict(journal.data['computer'], deleted=comp is None)
+            emit('resume', completed=sorted(journal.completed()))
+        else:
+            if comp is None:
+                raise Exception("Aucun lien entre le numéro de série de ce Mac et la base de données Jamf")
+            install_type, installers = timed_step('installers', find_installers, headers, auth)
+            if len(installers) == 0:
+                raise Exception("Aucun installeur MacOS trouvé")
+            installer = installers[0]
+            computer = {
+                'id':comp['id'],
+                'name':comp['name'],
+                'serial_number':serial
+            }
+            journal = ResetJournal.create(computer, install_type, installer)
+        emit('installer', type=install_type, installer=installer)
+        detected = timed_step('prewipe', detect_prewipe_targets)
+        emit('prewipe', targets=detected)
+
+        def set_step(step, text, color=None):
+            emit('status', step=step, text=text, color=color)
+        def on_status(step, status):
+            if status in ['running', 'cancelled']:
+                emit('step', step=step, status=status)
+            else:
+                emit('step', step=step, status=status, duration=round(pipeline.durations[step], 3))
+        pipeline = reset_pipeline(headers, auth, install_type, installer, computer, set_step, journal, detected)
+        pipeline.run(on_status)
+    except Exception as e:
+        log.error("Erreur pendant la réinstallation sans interface : {}".format(e))
+        emit('end', status='failed', duration=round(time.time() - start, 3), error='{}'.format(e), metrics=metrics.write(metrics_file))
+        return 1
+    emit('end', status='done', duration=round(time.time() - start, 3), metrics=metrics.write(metrics_file))
+    return 0
+
+
+###########################################################################
+### Admin bulk decommission mode
+###########################################################################
+bulk_results_fields = ['serial_number', 'id', 'name', 'status', 'files', 'duration', 'error']
+
+def decommission_computer(serial, headers, auth, uploader):
+    '''Archive the Jamf history of a computer to the SFTP server, then delete it from Jamf.
+    Returns a row of the results file.'''
+    start = time.time()
+    row = {'serial_number':serial, 'id':'', 'name':'', 'files':'', 'error':''}
+    try:
+        comp = find_computer(serial, headers, auth, scan=False)
+        if comp is None:
+            row['status'] = 'not_found'
+            return row
+        row['id'] = comp['id']
+        row['name'] = comp['name'].encode('utf-8')
+        files = export_history(headers, auth, comp['id'], serial, re.sub(r'\W+', '_', row['name']))
+        if files is None:
+            row['status'] = 'history_failed'
+            return row
+        row['files'] = ' '.join(os.path.basename(file_path) for file_path in files)
+        # The computer is only deleted once its history is safe on the SFTP server
+        if sftp_upload(files, uploader) is not True:
+            row['status'] = 'upload_failed'
+            return row
+        for file_path in files:
+            os.remove(file_path)
+        if delete_computer(comp['id'], auth) is not True:
+            row['status'] = 'delete_failed'
+            return row
+        row['status'] = 'done'
+        return row
+    except Exception as e:
+        row['status'] = 'error'
+        row['error'] = '{}'.format(e)
+        return row
+    finally:
+        row['duration'] = round(time.time() - start, 3)
+
+def run_decommission(serials_file, results_file):
+    '''Decommission every serial number of a CSV file (first column) with a pool of workers.
+    Each result is appended to results_file, serials already done in it are skipped when the run is resumed.
+    Returns the exit code.'''
+    headers = {'Accept':'application/json'}
+    auth = {
+        'api_user':jamf['api_user'],
+        'api_pass':jamf['api_pswd']
+    }
+    settings['api_max_rate'] = settings['bulk_max_rate']
+
+    with open(serials_file, 'rb') as f:
+        serials = [clean_serial(row[0]) for row in csv.reader(f) if len(row) > 0 and clean_serial(row[0])]
+    serials = [serial for serial in serials if serial.lower() not in ['serial', 'serialnumber', 'serial_number']]
+
+    done = set()
+    if os.path.exists(results_file):
+        with open(results_file, 'rb') as f:
+            done = set(row['serial_number'] for row in csv.DictReader(f) if row['status'] == 'done')
+    todo = Queue.Queue()
+    for serial in serials:
+        if serial not in done:
+            todo.put(serial)
+    total = todo.qsize()
+    emit('start', title=title, version=version, serials=len(serials), skipped=len(serials) - total)
+    # Sending the files left by a previous run
+    drain_spool()
+
+    results_lock = threading.Lock()
+    new_file = not os.path.exists(results_file)
+    results = open(results_file, 'ab')
+    writer = csv.DictWriter(results, fieldnames=bulk_results_fields)
+    if new_file:
+        writer.writeheader()
+    counts = {}
+    start = time.time()
+
+    def worker():
+        uploader = SFTPUploader()
+        try:
+            while True:
+                try:
+                    serial = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                row = decommission_computer(serial, headers, auth, uploader)
+                with results_lock:
+                    writer.writerow(row)
+                    results.flush()
+                    counts[row['status']] = counts.get(row['status'], 0) + 1
+                    processed = sum(counts.values())
+                emit('record', serial_number=serial, status=row['status'], duration=row['duration'], error=row['error'],
+                     processed=processed, total=total, rate=round(processed / max(time.time() - start, 0.001) * 60, 1))
+        finally:
+            uploader.close()
+
+    threads = []
+    for i in range(max(1, min(settings['bulk_workers'], total))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    results.close()
+
+    duration = max(time.time() - start, 0.001)
+    log.info("Décommission de {} Macs terminée en {:.2f}s : {}".format(total, duration, counts))
+    emit('end', duration=round(duration, 3), counts=counts, rate=round(total / duration * 60, 1), metrics=metrics.write(metrics_file))
+    return 0 if counts.get('done', 0) == total else 1
+
+
 ###########################################################################
 ### This is the main class
 ###########################################################################
@@ -282,11 +2336,18 @@ class JamfOneClickReinstall():
             'Accept':'application/json'
         }
 
-        # Checkin computer serial number
-        self.my_serial = get_serial()
-        if self.my_serial is None:
-            log.error("Erreur : impossible de déterminer le numéro de série de ce Mac !")
-            sys.exit(1)
+        # Queue of UI updates posted by the background threads
+        self.events = Queue.Queue()
+
+        # Computer serial number, read in background and needed by get_jamf_info
+        self.my_serial = None
+
+        # True from the credentials check on, connect is ignored until it fails
+        self.connecting = False
+        self.login_button = None
+
+        # An interrupted reset is offered once, at launch. A reset failing in this session leaves its journal too.
+        self.resume_checked = False
 
         # Initializing root window
         root.title_font = tkfont.Font(family='Helvetica', size=18, weight="bold")
@@ -309,6 +2370,12 @@ class JamfOneClickReinstall():
         # Launching first frame
         self.frame()
 
+        # Draining the UI events from the Tk main loop
+        root.after(50, self.process_events)
+
+        # Sending the files left by a previous run
+        self.run_in_background(drain_spool)
+
         # Displaying credentials frame or using autologon
         if jamf['autologon'].lower() == 'oui':
             self.connect(autologon='oui')
@@ -322,96 +2389,176 @@ class JamfOneClickReinstall():
         '''Display an info popup and logs to file'''
         log.info(msg)
         tkMessageBox.showinfo(title, msg)
-        root.update()
         
     def error(self, title, msg):
         '''Display an error popup and logs to file'''
         log.error(msg)
         tkMessageBox.showinfo(title, msg)
-        root.update()
 
-    def connect(self, event=None):
-        '''Try to connect to Jamf api server by listing all buildings in jamf. If succeed : connect is OK'''
+    def post(self, func, *args):
+        '''Queue a UI update from any thread, it will be run by the Tk main loop'''
+        self.events.put([func, args])
+
+    def process_events(self):
+        '''Run the UI updates posted by the background threads'''
         try:
+            while True:
+                func, args = self.events.get_nowait()
+                try:
+                    func(*args)
+                except Exception as e:
+                    log.error("Erreur pendant la mise à jour de l'interface : {}".format(e), exc_info=True)
+        except Queue.Empty:
+            pass
+        root.after(50, self.process_events)
+
+    def run_in_background(self, task, on_success=None, on_error=None, args=()):
+        '''Run a blocking task on a worker thread. The callbacks are run by the Tk main loop
+        with the result of the task or the exception it raised.'''
+        def runner():
+            try:
+                result = task(*args)
+            except Exception as e:
+                if on_error is not None:
+                    self.post(on_error, e)
+                else:
+                    log.error("Erreur dans la tâche {} : {}".format(task.__name__, e), exc_info=True)
+            else:
+                if on_success is not None:
+                    self.post(on_success, result)
+        worker = threading.Thread(target=runner, name=task.__name__)
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def window_displayed(self, profile=False):
+        '''Called once the first frame is drawn : bring the window to the front, then load the heavy libraries'''
+        metrics.record('init', 'first_frame', startup_time, time.time() - startup_time)
+        try:
+            import_module('AppKit').NSApplication.sharedApplication().activateIgnoringOtherApps_(True)
+        except Exception as e:
+            log.error("*** Erreur *** Impossible d'importer la librairie Python AppKit.\nContacter le support IP-Echanges.\n\nRaison : {}".format(e))
+        start_preloads()
+        if profile is True:
+            self.run_in_background(wait_preloads, self.startup_profiled)
+
+    def startup_profiled(self, result):
+        '''End of the --profile-startup mode : report the startup durations and quit'''
+        lines = startup_report()
+        for line in lines:
+            log.info(line)
+        sys.stdout.write('\n'.join(lines) + '\n')
+        metrics.write(metrics_file)
+        self.quit()
+
+    def set_step(self, step, text, fg=None):
+        '''Update a step label of the reset frame, can be called from any thread'''
+        self.post(self.configure_step, step, text, fg)
+
+    def configure_step(self, step, text, fg):
+        if fg is None:
+            self.step[step].configure(text=text)
+        else:
+            self.step[step].configure(text=text, fg=fg)
+
+    def show_wait(self):
+        '''Display the waiting label in the main frame'''
+        self.wait = tk.Label(self.main_frame, text='Veuillez patienter...', font='System 50 bold')
+        self.wait.pack(fill='both', anchor='center', pady=100)
+
+    def connect(self, autologon=None, event=None):
+        '''Try to connect to Jamf api server by requesting an API token. If succeed : connect is OK'''
+        # A double click or a second Return press during the check would connect twice
+        if self.connecting is True:
+            return
+        self.connecting = True
+        if self.login_button is not None:
+            self.login_button.configure(state='disabled')
+        if autologon == 'oui':
+            self.auth = {
+                    'api_user':jamf['api_user'],
+                    'api_pass':jamf['api_pswd']
+                }
+        else:
             self.auth = {
                 'api_user':self.log_user.get(),
                 'api_pass':self.log_pswd.get()
             }
-            list_buildings(self.json_headers, self.auth)
-        except ValueError:
+        self.run_in_background(check_credentials, self.connected, self.connect_failed, args=(self.json_headers, self.auth))
+
+    def connect_failed(self, e):
+        self.connecting = False
+        if self.login_button is not None:
+            self.login_button.configure(state='normal')
+        if isinstance(e, ImportError):
+            self.error("Erreur de connexion", "Impossible d'importer la librairie Python requests.\nContacter le support IP-Echanges.\n\nRaison : {}".format(e))
+        elif isinstance(e, ValueError):
             self.error("Erreur de connexion", "Identifiants invalides ou non autorisés...")
-        except requests.ConnectionError:
+        elif isinstance(e, requests.ConnectionError):
             self.error("Erreur de connexion", "Serveur Jamf injoignable, veuillez vérifier votre accès réseau...")
-        except Exception as e:
-            self.error("Erreur de connexion", "Impossible de lancer la connexion au serveur Jamf.\nRaison : {}".format(e))
         else:
-            log.info("Identifiant API Jamf '{}' connecté".format(self.auth['api_user']))
-            self.login_frame.destroy()
-            self.wait = tk.Label(self.main_frame, text='Veuillez patienter...', font='System 50 bold')
-            self.wait.pack(fill='both', anchor='center', pady=50)
-            root.update()
-            root.after(500, self.get_jamf_info)
+            self.error("Erreur de connexion", "Impossible de lancer la connexion au serveur Jamf.\nRaison : {}".format(e))
 
-    def connect(self, autologon=None, event=None):
-        '''Try to connect to Jamf api server by listing all buildings in jamf. If succeed : connect is OK'''
+    def connected(self, result):
+        log.info("Identifiant API Jamf '{}' connecté".format(self.auth['api_user']))
         try:
-            if autologon == 'oui':
-                self.auth = {
-                        'api_user':jamf['api_user'],
-                        'api_pass':jamf['api_pswd']
-                    }
-            else:
-                self.auth = {
-                    'api_user':self.log_user.get(),
-                    'api_pass':self.log_pswd.get()
-                }
-            list_buildings(self.json_headers, self.auth)
-        except ValueError:
-            self.error("Erreur de connexion", "Identifiants invalides ou non autorisés...")
-            root.update()
-        except requests.ConnectionError:
-            self.error("Erreur de connexion", "Serveur Jamf injoignable, veuillez vérifier votre accès réseau...")
-            root.update()
-        except Exception as e:
-            self.error("Erreur de connexion", "Impossible de lancer la connexion au serveur Jamf.\nRaison : {}".format(e))
-            root.update()
-        else:
-            log.info("Identifiant API Jamf '{}' connecté".format(self.auth['api_user']))
-            try:
-                self.login_frame.destroy()
-            except:
-                pass
-            self.wait = tk.Label(self.main_frame, text='Veuillez patienter...', font='System 50 bold')
-            root.update()
-            self.wait.pack(fill='both', anchor='center', pady=100)
-            root.after(500, self.get_jamf_info)
+            self.login_frame.destroy()
+        except:
+            pass
+        self.show_wait()
+        self.get_jamf_info()
             
     def get_jamf_info(self):
         '''Search for this computer in Jamf'''
-        try:
-            match = False
-            for computer in list_computers(self.json_headers, self.auth):
-                comp = computer_detail(computer['id'], self.json_headers, self.auth)
-                if comp['general']['serial_number'] == self.my_serial:
-                    log.info("Ce Mac a été identifié dans jamf, {} avec l'ID {}".format(comp['general']['name'].encode("utf-8"), comp['general']['id']))
-                    self.my_mac = comp
-                    self.my_id = comp['general']['id']
-                    self.my_name = comp['general']['name']
-                    match = True
-                    break
-            if match is True:
-                self.wait.destroy()
-                self.show_config_frame()
-            else:
-                self.error('Erreur Jamf', "Aucun lien entre le numéro de série de ce Mac et la base de données Jamf !\nL'application va quitter...")
-                sys.exit(1)
-        except Exception as e:
-            root.update()
-            text = "Une erreur a empêché la récupération des informations Jamf.\nVeuillez tenter de rafraichir les champs manuellement ou contacter le support IP Echanges\n\nRaison : {}".format(e)
-            confirm = tkMessageBox.askokcancel("Erreur Jamf", text)
-            if confirm is True:
-                root.after(1000, self.get_jamf_info)
-    
+        def progress(checked, total, rate):
+            self.post(self.scan_progress, checked, total, rate)
+        def find_this_computer():
+            if self.my_serial is None:
+                self.my_serial = preloaded('serial')
+            if self.my_serial is None:
+                raise Exception("impossible de déterminer le numéro de série de ce Mac !")
+            return find_with_journal(self.my_serial, self.json_headers, self.auth, progress)
+        self.run_in_background(find_this_computer, self.jamf_info_received, self.jamf_info_failed)
+
+    def jamf_info_received(self, result):
+        # After a failure in this session the resume is only offered if the Mac is already deleted from Jamf,
+        # it can't be reset again without its journal
+        journal, comp = result
+        if self.resume_checked is True and comp is not None:
+            journal = None
+        self.resume_checked = True
+        if journal is not None:
+            completed = len(journal.completed())
+            text = "Une réinstallation de ce Mac a été interrompue le {} ({} étape(s) terminée(s)).\nVoulez-vous la reprendre ?".format(
+                time.strftime('%d/%m/%Y à %H:%M', time.localtime(journal.data['started'])), completed)
+            if tkMessageBox.askyesno("Réinstallation interrompue", text) is True:
+                self.resume_reset(journal, comp)
+                return
+            log.info("Reprise de la réinstallation interrompue refusée par l'utilisateur")
+            journal.clear()
+        if comp is not None:
+            log.info("Ce Mac a été identifié dans jamf, {} avec l'ID {}".format(comp['name'].encode("utf-8"), comp['id']))
+            self.in_jamf = True
+            self.my_id = comp['id']
+            self.my_name = comp['name']
+            self.wait.destroy()
+            self.show_config_frame()
+        else:
+            self.error('Erreur Jamf', "Aucun lien entre le numéro de série de ce Mac et la base de données Jamf !\nL'application va quitter...")
+            sys.exit(1)
+
+    def jamf_info_failed(self, e):
+        log.error("Erreur pendant la recherche du Mac dans Jamf : {}".format(e))
+        text = "Une erreur a empêché la récupération des informations Jamf.\nVeuillez tenter de rafraichir les champs manuellement ou contacter le support IP Echanges\n\nRaison : {}".format(e)
+        confirm = tkMessageBox.askokcancel("Erreur Jamf", text)
+        if confirm is True:
+            root.after(1000, self.get_jamf_info)
+
+    def scan_progress(self, checked, total, rate):
+        '''Display the inventory scan progress on the waiting screen'''
+        if self.wait.winfo_exists():
+            self.wait.configure(text='Recherche du Mac dans Jamf...\n{} / {} Macs vérifiés ({:.0f}/s)'.format(checked, total, rate), font='System 30 bold')
+
     def resync(self):
         '''Update the fields with a Jamf poll'''
         for frame in [self.reset_title_frame, self.reset_frame, self.reset_button_frame]:
@@ -419,8 +2566,7 @@ class JamfOneClickReinstall():
                 frame.destroy()
             except:
                 pass
-        self.wait = tk.Label(self.main_frame, text='Veuillez patienter...', font='System 50 bold')
-        self.wait.pack(fill='both', anchor='center', pady=50)
+        self.show_wait()
         root.after(500, self.get_jamf_info)
     
 #############################################
@@ -443,7 +2589,51 @@ class JamfOneClickReinstall():
         log_frame = tk.Frame(self.container, bg='white')
         log_frame.pack(fill='both', side='bottom')
         tk.Label(log_frame, text='Emplacement des logs : {}'.format(logs_file), font='System 12 italic', bg='white').pack(side='left', padx=8, pady=8)
-        tk.Button(log_frame, text='Afficher la console de logs', command=show_logs, highlightbackground='white').pack(side='right', padx=8, pady=8)
+        self.logs_button = tk.Button(log_frame, text='Afficher les logs', command=self.toggle_logs, highlightbackground='white')
+        self.logs_button.pack(side='right', padx=8, pady=8)
+
+        # Log pane, tailing the log file while it is displayed
+        self.logs_frame = tk.Frame(self.container, bg='white')
+        self.logs_text = tk.Text(self.logs_frame, height=12, font='Menlo 10', bg='white', wrap='none', state='disabled')
+        scrollbar = tk.Scrollbar(self.logs_frame, command=self.logs_text.yview)
+        self.logs_text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        self.logs_text.pack(side='left', fill='both', expand='yes')
+        self.logs_tail = None
+        self.logs_after = None
+
+    def toggle_logs(self):
+        '''Show or hide the log pane under the main frame'''
+        width, height = 900, 400
+        if self.logs_tail is None:
+            self.logs_tail = LogTail(logs_file)
+            self.logs_frame.pack(fill='both', side='bottom', before=self.main_frame)
+            self.logs_button.configure(text='Masquer les logs')
+            height += 200
+            self.tail_logs()
+        else:
+            self.logs_tail = None
+            root.after_cancel(self.logs_after)
+            self.logs_frame.pack_forget()
+            self.logs_button.configure(text='Afficher les logs')
+        root.geometry("{}x{}".format(width, height))
+
+    def tail_logs(self, max_lines=1000):
+        '''Append the new lines of the log file to the log pane, every half second while it is displayed'''
+        if self.logs_tail is None:
+            return
+        lines = self.logs_tail.read()
+        if len(lines) > 0:
+            at_end = self.logs_text.yview()[1] >= 1.0
+            self.logs_text.configure(state='normal')
+            self.logs_text.insert('end', '\n'.join(lines).decode('utf-8', 'replace') + '\n')
+            extra = int(self.logs_text.index('end-1c').split('.')[0]) - max_lines
+            if extra > 0:
+                self.logs_text.delete('1.0', '{}.0'.format(extra + 1))
+            self.logs_text.configure(state='disabled')
+            if at_end:
+                self.logs_text.see('end')
+        self.logs_after = root.after(500, self.tail_logs)
 
     def user_login_frame(self):
         '''Create a login frame to prevent everyone to use the application'''
@@ -466,10 +2656,25 @@ class JamfOneClickReinstall():
 
         # Buttons
         tk.Button(self.login_frame, text='Quitter', command=root.destroy).grid(row=3, column=0, sticky='ew', padx=(180,10), pady=(3, 0))
-        tk.Button(self.login_frame, text='Connexion', command=self.connect).grid(row=3, column=1, sticky='ew', pady=(3, 0))
+        self.login_button = tk.Button(self.login_frame, text='Connexion', command=self.connect)
+        self.login_button.grid(row=3, column=1, sticky='ew', pady=(3, 0))
         
     def show_config_frame(self):
+        '''Search the available installers in background, then display the configuration frame'''
+        self.run_in_background(find_installers, self.display_config_frame, self.config_frame_failed, args=(self.json_headers, self.auth))
+
+    def config_frame_failed(self, e):
+        self.error("Erreur", "Impossible de récupérer la liste des installeurs MacOS !\nRaison : {}".format(e))
+        self.resync()
+
+    def display_config_frame(self, found):
         '''This frame displays the main configuration fields'''
+        self.install_type, installers = found
+        if len(installers) == 0:
+            self.error("Erreur", "Aucun installeur MacOS trouvé dans la DB Jamf !")
+            self.resync()
+            return
+
         # MacOS reset title
         self.reset_title_frame = tk.Frame(self.main_frame)
         self.reset_title_frame.pack(fill='both', side='top')
@@ -483,196 +2688,154 @@ class JamfOneClickReinstall():
         # MacOS Installer Choice      
         text = tk.Label(self.reset_frame, text="Version macOS à réinstaller ({} recommandé) :".format(jamf["macos_last_version"]))
         text.grid(row=2, column=0, sticky='w', padx=10, pady=(30, 0))
-
-        installers = search_local_installer(jamf['macos_last_version'])
-        if installers is False:
-            self.install_type = 'remote'
-            log.info("Recherche d'installeurs distants dans la DB Jamf")
-            installers = list_policies(self.json_headers, self.auth, jamf['policy_match_name'])
-            if len(installers) == 0:
-                self.error("Erreur", "Aucun installeur MacOS trouvé dans la DB Jamf !")
-                self.resync()
-        else:
-            installers = [installers]
-            self.install_type = 'local'
             
         self.installer = tk.StringVar()
         self.installer.set(installers[0])
         tk.OptionMenu(self.reset_frame, self.installer, *installers).grid(row=2, column=1, sticky='ew', pady=(30, 0))
+
+        # Fetching the details of the selected policy, and optionally the installer itself, while the user is reading the screen
+        if self.install_type == 'remote':
+            self.prefetch_label = tk.Label(self.reset_frame, text="", fg='blue')
+            self.prefetch_label.grid(row=3, column=0, columnspan=2, sticky='w', padx=10, pady=(10, 0))
+            self.prefetch_installer()
+            self.installer.trace('w', lambda *args: self.prefetch_installer())
+
+        # Targets of the uninstall policies, probed while the user is reading the screen
+        self.prewipe_labels = {}
+        for row, task in enumerate(prewipe_tasks, 4):
+            self.prewipe_labels[task['step']] = tk.Label(self.reset_frame, text="{} : détection en cours...".format(task['title']))
+            self.prewipe_labels[task['step']].grid(row=row, column=0, columnspan=2, sticky='w', padx=10, pady=(3, 0))
+        self.prewipe = Preload('prewipe', detect_prewipe_targets)
+        self.prewipe.start()
+        self.run_in_background(self.prewipe.get, self.prewipe_detected)
         
         # Buttons
         self.reset_button_frame = tk.Frame(self.main_frame)
         self.reset_button_frame.pack(fill='both', side='top')
         tk.Button(self.reset_button_frame, text='Lancer la réinstallation', command=self.reset_computer).pack(fill='x', expand='yes', side='right', padx=5, pady=10)
-        tk.Button(self.reset_button_frame, text='Annuler et quitter', command=root.destroy).pack(fill='x', expand='yes', side='right', padx=(5, 0), pady=10)
+        tk.Button(self.reset_button_frame, text='Annuler et quitter', command=self.quit).pack(fill='x', expand='yes', side='right', padx=(5, 0), pady=10)
 
-    def reset_computer(self):
-        '''Delete the computer from Jamf DB and reinstall it from scratch'''
-        try:
-            confirm = tkMessageBox.askokcancel("Confirmation nécessaire", "Vous êtes sur le point de totalement réinstaller votre Mac.\nVoulez-vous continuer ?")
+    def prefetch_installer(self):
+        '''Prefetch the selected policy details and, if enabled, start downloading its installer'''
+        policy = self.installer.get()
+        policy_catalog.prefetch(self.json_headers, self.auth, policy)
+        if settings['prefetch_installer'] is not True:
+            return
+        download = start_installer_download(self.json_headers, self.auth, policy)
+        self.prefetch_label.configure(text="Préchargement de l'installeur en cours...")
+        download.attach(lambda progress: self.post(self.prefetch_progress, download, progress))
 
-            if confirm is not True:
-                log.info("Réinstallation annulée par l'utilisateur, redémarrage de l'application...")
-                self.resync()
-                return
-            else:
-                # Destroy the previous frames and create a new one with steps states
-                self.reset_button_frame.destroy()
-                self.reset_frame.destroy()
-                self.reset_frame = tk.Frame(self.main_frame)
-                self.reset_frame.pack(fill='both', side='top', padx=5)
-
-                list_steps = [
-                    ["check_download", "Téléchargement de l'installeur MacOS en attente..."],
-                    ["check_del_adobe", 'Désactivation de la suite Adobe CC2019 en attente...'],
-                    ["check_del_eset", "Suppression de l'antivirus ESET en attente..."],
-                    ["check_upload_history", "Sauvegarde des infos Jamf vers SFTP en attente..."],
-                    ["check_del_computer", 'Suppression de la base Jamf en attente...'],
-                    ["check_launch_reset", "Réinitialisation de l'ordinateur en attente..."],
-                    ["check_reboot", ""]
-                ]
-
-                step ={}
-                
-                i = 0
-                for each_step in list_steps:
-                    step[each_step[0]] = tk.Label(self.reset_frame, text=each_step[1])
-                    step[each_step[0]].grid(row=i, column=0, sticky='w', padx=100, pady=(3, 0))
-                    i += 1
-
-                root.update()
-
-                ### Launch the steps
-                # If installer is 'remote', download it from Jamf. Else launch directly the reinstall
-                if self.install_type == 'remote':
-                    try:
-                        chosen_policy = get_policy_details(self.json_headers, self.auth, self.installer.get())
-                        trigger = chosen_policy['policy']['general']['trigger_other']
-                        log.info("Téléchargement de l'installeur MacOS en cours, veuillez patienter...")
-                        step['check_download'].configure(text="Téléchargement de l'installeur MacOS en cours...", fg="blue")
-                        root.update()
-                        if jamf_cmd('policy -event {}'.format(trigger)) is True:
-                            log.info("Téléchargement terminé")
-                            package_name = search_local_installer(jamf['macos_last_version'])
-                            if package_name is not False:
-                                step['check_download'].configure(text="Téléchargement terminé et validé", fg="green")
-                            else:
-                                raise Exception("Le paquet téléchargé n'a pas été trouvé dans la liste des applications")
-                        else:
-                            raise Exception("La commande Jamf de téléchargement du paquet a terminé en erreur")
-                    except Exception as e:
-                        log.error("Erreur pendant le téléchargement : {}".format(e), exc_info=True)
-                        step['check_download'].configure(text="Téléchargement en erreur !", fg="red")
-                        self.error("Erreur", "Une erreur a empêché le téléchargement de l'installeur MacOS ! Annulation...")
-                        self.resync()
-                        return
-                else:
-                    package_name = self.installer.get()
-                    step['check_download'].configure(text="Installeur local sélectionné", fg="green")
-
-                root.update()
-
-                # Remove all adobe CC2019 apps with jamf policy
-                if os.path.exists('/Applications/Adobe Premiere Pro CC 2019/Adobe Premiere Pro CC 2019.app/Contents/Info.plist'):
-                    if jamf_cmd('policy -event uninstall_adobe') is True:
-                        log.info("Applications Adobe supprimées avec succès")
-                        step['check_del_adobe'].configure(text="Désactivation de la suite Adobe CC2019 : OK", fg="green")
-                    else:
-                        step['check_del_adobe'].configure(text="Désactivation de la suite Adobe CC2019 : Erreur", fg="red")
-                        log.error("Une erreur a empêché la suppression des applications Adobe !")
-                else:
-                    step['check_del_adobe'].configure(text="Désactivation de la suite Adobe CC2019 : Non installé", fg="green")
-                    log.error("Adobe CC2019 n'existe pas sur cette machine")
+    def prefetch_progress(self, download, progress):
+        if download is not installer_download or not self.prefetch_label.winfo_exists():
+            return
+        self.prefetch_label.configure(text="Préchargement de l'installeur en cours : {}".format(format_progress(progress)))
 
-                root.update()
+    def prewipe_detected(self, detected):
+        for task in prewipe_tasks:
+            if self.prewipe_labels[task['step']].winfo_exists():
+                self.prewipe_labels[task['step']].configure(text="{} : {}".format(task['title'], describe_targets(detected[task['step']])))
 
-                # Remove ESET antivirus app with jamf policy
-                if jamf_cmd('policy -event uninstall_eset') is True:
-                    log.info("Application antivirus ESET supprimée avec succès")
-                    step['check_del_eset'].configure(text="Suppression de l'antivirus ESET : OK", fg="green")
-                else:
-                    step['check_del_eset'].configure(text="Suppression de l'antivirus ESET : Erreur", fg="red")
-                    log.error("Une erreur a empêché la suppression de l'application antivirus ESET !")
-                
-                root.update()
-
-                # Upload the computer history to our SFTP server
-                if upload_history(self.json_headers, self.auth, self.my_id, self.my_serial, self.my_name) is True:
-                    step['check_upload_history'].configure(text="Sauvegarde des infos Jamf vers SFTP : OK", fg="green")
-                else:
-                    step['check_upload_history'].configure(text="Sauvegarde des infos Jamf vers SFTP  : Erreur", fg="red")
-                    log.error("Une erreur a empêché la sauvegarde des infos Jamf vers FTP !")
-                
-                root.update()
-
-                # Delete this computer from the Jamf DB to prevent conflicts
-                if delete_computer(self.my_id, self.auth) is True:
-                    log.info("Mac supprimé de la base données Jamf avec succès")
-                    step['check_del_computer'].configure(text="Suppression de la base Jamf : OK", fg="green")
-                    root.update()
-                else:
-                    step['check_del_computer'].configure(text="Suppression de la base Jamf : Erreur", fg="red")
-                    self.error("Erreur", "Une erreur a empêché la suppression du Mac de la DB Jamf ! Merci de contacter le support IP-Echanges")
-                    self.resync()
-                    return
+    def quit(self):
+        cancel_installer_download()
+        root.destroy()
 
-                # Launch the reinstall command
-                try:
-                    reset_command = threading.Thread(target=launch_reset, args=(package_name,))
-                    reset_command.start()
-                    step['check_launch_reset'].configure(text="Lancement de la réinstallation : OK", fg="green")
-                    step['check_reboot'].configure(text="Redémarrage en cours, veuillez patientier...", fg="blue")
-                    root.update()
-                    log.info("La procédure de réinstallation est lancée, cliquez sur OK pour autoriser le redémarrage.")
-                    show_jamfhelper()
-                    
-                except Exception as e:
-                    log.error("Erreur pendant la réinstallation : {}".format(e))
-                    step['check_launch_reset'].configure(text="Lancement de la réinstallation : Erreur", fg="red")
-                    root.update()
-                    text = "Attention !\nLa commande de réinitialisation ne s'est pas effectuée correctement ! Merci de contacter le support IP-Echanges"
-                    self.error("Erreur pendant la réinitialisation", text)
-                    self.resync()
-                    return
-        except Exception as e:
-            log.error("Erreur dans la fonction reset_computer : {}".format(e), exc_info=True)
+    def reset_computer(self):
+        '''Delete the computer from Jamf DB and reinstall it from scratch'''
+        text = "Vous êtes sur le point de totalement réinstaller votre Mac.\n"
+        if self.prewipe.done.is_set() and self.prewipe.error is None:
+            policies = [task['title'] for task in prewipe_tasks if self.prewipe.result[task['step']] != []]
+            text += "Désinstallations lancées avant la réinstallation : {}\n".format(', '.join(policies) if policies else "aucune")
+        confirm = tkMessageBox.askokcancel("Confirmation nécessaire", text + "Voulez-vous continuer ?")
+
+        if confirm is not True:
+            log.info("Réinstallation annulée par l'utilisateur, redémarrage de l'application...")
             self.resync()
             return
+
+        # Destroy the previous frames and create a new one with steps states
+        installer = self.installer.get()
+        self.reset_button_frame.destroy()
+        self.reset_frame.destroy()
+        self.show_steps_frame()
+
+        ### Launch the steps on a worker thread, the labels are updated through the UI events queue
+        self.run_in_background(self.reset_steps, None, self.reset_failed, args=(installer,))
+
+    def resume_reset(self, journal, comp):
+        '''Resume an interrupted reset from its journal, comp is None if the Mac was already deleted from Jamf'''
+        computer = journal.data['computer']
+        log.info("Reprise de la réinstallation interrompue, étapes terminées : {}".format(', '.join(sorted(journal.completed()))))
+        self.in_jamf = comp is not None
+        self.my_id = computer['id']
+        self.my_name = computer['name']
+        self.install_type = journal.data['install_type']
+        self.wait.destroy()
+        self.show_steps_frame()
+        self.run_in_background(self.reset_steps, None, self.reset_failed, args=(journal.data['installer'], journal))
+
+    def show_steps_frame(self):
+        '''Create the frame displaying the state of each reset step'''
+        self.reset_frame = tk.Frame(self.main_frame)
+        self.reset_frame.pack(fill='both', side='top', padx=5)
+
+        list_steps = [["check_download", "Téléchargement de l'installeur MacOS en attente..."]]
+        list_steps += [[task['step'], "{} en attente...".format(task['title'])] for task in prewipe_tasks]
+        list_steps += [
+            ["check_upload_history", "Sauvegarde des infos Jamf vers SFTP en attente..."],
+            ["check_del_computer", 'Suppression de la base Jamf en attente...'],
+            ["check_launch_reset", "Réinitialisation de l'ordinateur en attente..."],
+            ["check_reboot", ""]
+        ]
+
+        self.step = {}
         
+        i = 0
+        for each_step in list_steps:
+            self.step[each_step[0]] = tk.Label(self.reset_frame, text=each_step[1])
+            self.step[each_step[0]].grid(row=i, column=0, sticky='w', padx=100, pady=(3, 0))
+            i += 1
+
+    def reset_failed(self, e):
+        if isinstance(e, ResetError):
+            self.error(e.title, "{}".format(e))
+        else:
+            log.error("Erreur dans la fonction reset_computer : {}".format(e), exc_info=True)
+        self.resync()
+
+    def reset_steps(self, installer, journal=None):
+        '''Run the reset steps graph, called from a worker thread. A journal is given to resume an interrupted reset.'''
+        computer = {
+            'id':self.my_id,
+            'name':self.my_name,
+            'serial_number':self.my_serial
+        }
+        if journal is None:
+            journal = ResetJournal.create(computer, self.install_type, installer)
+        computer['deleted'] = not self.in_jamf
+        try:
+            preloaded('pysftp')
+        except ImportError as e:
+            raise ResetError("Erreur", "Impossible d'importer la librairie Python pysftp, la sauvegarde vers le serveur SFTP est impossible.\nContacter le support IP-Echanges.\n\nRaison : {}".format(e))
+        detected = self.prewipe.get() if getattr(self, 'prewipe', None) is not None else None
+        pipeline = reset_pipeline(self.json_headers, self.auth, self.install_type, installer, computer, self.set_step, journal, detected)
+        try:
+            pipeline.run()
+        finally:
+            metrics.write(metrics_file)
 
     
 ###########################################################################
 ### Start the main application
 ###########################################################################
 if __name__ == '__main__':
+    metrics.record('init', 'module', startup_time, time.time() - startup_time)
     log.info('--- Lancement de {}, {} ---'.format(title, version))
 
-    # Import downloaded libraries
-    try:
-        import requests
-    except Exception as e:
-        log.error("*** Erreur *** Impossible d'importer la librairie Python requests.\nContacter le support IP-Echanges.\n\nRaison : {}".format(e))
-        sys.exit(1)
-
-    try:
-        import AppKit
-    except Exception as e:
-        log.error("*** Erreur *** Impossible d'importer la librairie Python AppKit.\nContacter le support IP-Echanges.\n\nRaison : {}".format(e))
-        sys.exit(1)
-    
-    try:
-        import pysftp
-    except Exception as e:
-        log.error("*** Attention *** Impossible d'importer la librairie Python pysftp.\nCeci empêchera le script de créer une sauvegarde vers un serveur SFTP distant.\n\nRaison : {}".format(e))
-        sys.exit(1)
-        
-    # Import caffeine and prevent mac from sleeping    
-    try:
-    	import caffeine
-        caffeine.on(display=True)
-        log.info("Module Caffeine activé, mise en veille interdite")
-    except:
-    	log.warning("Impossible d'activer le module caffeine, le Mac risque de passer en mode veille en cours d'installation")
+    # Downloaded libraries, loaded in background once the window is displayed.
+    # The functions using them wait for them with preloaded().
+    preload('requests', import_module, 'requests')
+    preload('pysftp', import_module, 'pysftp')
+    preload('caffeine', enable_caffeine)
 
     # Defining main API variables
     try:
@@ -702,14 +2865,47 @@ if __name__ == '__main__':
             }
         log.info('Using test parameters as main variables')
 
+    # Reference digest of an installer, to set as JAMF_FTV_INSTALLER_DIGEST : --installer-digest <path of the .app>
+    if len(sys.argv) > 2 and sys.argv[1] == '--installer-digest':
+        print(payload_digest(sys.argv[2]))
+        sys.exit(0)
+
+    # Admin bulk decommission mode : --decommission <serials.csv> <results.csv> followed by the usual arguments
+    decommission = len(sys.argv) > 3 and sys.argv[1] == '--decommission'
+
+    # Headless mode : '--headless' flag instead of one of the first three Jamf arguments, or autologon set to 'headless'
+    headless = decommission or '--headless' in sys.argv[1:4] or jamf['autologon'].lower() == 'headless'
+
+    # Start-up profiling : '--profile-startup' flag, the imports and init durations are reported once the window is displayed
+    profile_startup = '--profile-startup' in sys.argv[1:4]
+
     # Common variables
     sftp_root = '/'
 
+    # Run without window
+    if decommission is True:
+        start_preloads()
+        sys.exit(run_decommission(sys.argv[2], sys.argv[3]))
+    if headless is True:
+        start_preloads()
+        sys.exit(run_headless())
+
+    # The serial number is read while Tkinter loads
+    preload('serial', get_serial).start()
+    with metrics.span('import', 'Tkinter'):
+        import Tkinter as tk
+        import tkMessageBox
+        import ttk
+        import tkFont as tkfont 
+
     # Kill Self Service app
-    os.system('killall "Self Service"')
+    if profile_startup is False:
+        os.system('killall "Self Service"')
     
     # Launch Tkinter app
-    root = tk.Tk()
-    app = JamfOneClickReinstall(root)
-    AppKit.NSApplication.sharedApplication().activateIgnoringOtherApps_(True)
+    with metrics.span('init', 'window'):
+        root = tk.Tk()
+        app = JamfOneClickReinstall(root)
+        root.protocol('WM_DELETE_WINDOW', app.quit)
+    root.after_idle(app.window_displayed, profile_startup)
     root.mainloop()